@@ -7,10 +7,10 @@ from discord_slash.utils.manage_commands import create_option, create_choice
 from discord_slash.utils.manage_commands import create_permission
 
 import config
-from includes import general, msg
+from includes import general, msg, query_stats
 from includes.general import admin_channel
 from schemas import ingame_schema, member_schema
-from services import game_service
+from services import analytics_service, game_service, map_service
 
 
 class Admin(commands.Cog):
@@ -235,6 +235,62 @@ class Admin(commands.Cog):
         embed = discord.Embed(description="Okay, **goodnight!** :heartpulse:")
         await ctx.send(embed=embed, hidden=True)
 
+    @cog_ext.cog_slash(
+        name="rebuildstats",
+        description="Recounts player stats and leaderboard data from match history (Admin only)",
+        guild_ids=config.variables['guild_ids']
+    )
+    async def _rebuildstats(self, ctx: SlashContext):
+        if not await general.admin_channel(ctx, ctx.author):
+            return
+        if await check_admin(ctx) < 3:
+            await msg.lacks_permission(ctx)
+            return
+        await ctx.defer(hidden=True)
+        corrected = await analytics_service.rebuild()
+        await ctx.send(f"Rebuilt stats. Corrected counters for **`{corrected}`** players.", hidden=True)
+
+    @cog_ext.cog_slash(
+        name="reloadmaps",
+        description="Reloads the map pools and weights from the map files (Admin only)",
+        guild_ids=config.variables['guild_ids']
+    )
+    async def _reloadmaps(self, ctx: SlashContext):
+        if not await general.admin_channel(ctx, ctx.author):
+            return
+        if await check_admin(ctx) < 2:
+            await msg.lacks_permission(ctx)
+            return
+        try:
+            version = map_service.reload()
+        except (OSError, ValueError) as e:
+            await msg.error(ctx, f"Couldn't reload maps: {e}")
+            return
+        await ctx.send(f"Loaded **`{len(map_service.maps)}`** maps (version {version}).", hidden=True)
+
+    @cog_ext.cog_slash(
+        name="tracemongo",
+        description="Logs every Mongo command of the next run of a command (Admin only)",
+        options=[
+            create_option(
+                name="command",
+                description="Slash command name, or an operation such as component:<id> or loop_iteration:autoremove",
+                required=True,
+                option_type=3
+            )
+        ],
+        guild_ids=config.variables['guild_ids']
+    )
+    async def _tracemongo(self, ctx: SlashContext, command: str):
+        if not await general.admin_channel(ctx, ctx.author):
+            return
+        if await check_admin(ctx) < 3:
+            await msg.lacks_permission(ctx)
+            return
+        operation = command if ":" in command else f"slash_command:{command}"
+        query_stats.trace_next(operation)
+        await ctx.send(f"The next **`{operation}`** will log its Mongo commands.", hidden=True)
+
     @cog_ext.cog_slash(
         name="remove",
         description="Remove player from queue",
@@ -382,7 +438,7 @@ class Admin(commands.Cog):
             return
         if category == "banned":
             banned_list = member_schema.get_all_banned()
-            if banned_list.count() < 1:
+            if not banned_list:
                 embed = discord.Embed(title="Banned", description="No one is **banned**.", color=msg.success_color)
                 await ctx.send(embed=embed, hidden=True)
             else:
@@ -393,7 +449,7 @@ class Admin(commands.Cog):
                 await ctx.send(embed=embed, hidden=True)
         else:
             warning_list = member_schema.get_all_warned()
-            if warning_list.count() < 1:
+            if not warning_list:
                 embed = discord.Embed(title="Warned", description="No one has been **warned**.",
                                       color=msg.success_color)
                 await ctx.send(embed=embed, hidden=True)
@@ -1,5 +1,3 @@
-import uuid
-
 import discord
 from discord.ext import commands
 from discord_slash import cog_ext
@@ -9,8 +7,10 @@ from discord_slash.model import ContextMenuType
 import config
 from cogs.shared.add import add
 from includes import msg, general
+from includes.queue_board import board
 from models.queue_models import Queue as QueueEnum
-from schemas import queue_schema, general_schema, member_schema
+from schemas import queue_schema
+from services import profile_service
 
 
 class CommandContextMenus(commands.Cog):
@@ -56,18 +56,9 @@ class CommandContextMenus(commands.Cog):
         user = ctx.author
         if not await general.correct_channel(ctx, user):
             return
-        queues = [QueueEnum.QUICKPLAY.value]
-        embed = discord.Embed(color=msg.success_color)
-        for q in queues:
-            is_live = queue_schema.queue_is_ingame(q)
-            players = []
-            for player in queue_schema.get_queue_players(q):
-                players.append(f"**`{player['username'][:14]}`**")
-            embed.add_field(
-                name=f"{config.variables['live'] if is_live else ''}**{q.upper()}** **`[{queue_schema.get_queue_count(QueueEnum(q))}/10]`**",
-                value="**`OPEN`**" if len(players) < 1 else '\n'.join(players))
-
-        await ctx.send(embed=embed)
+        if board.embed is None:
+            await board.update(self.bot)
+        await msg.queue_status(ctx, board.embed, board.jump_url(ctx.guild.id))
 
     @cog_ext.cog_context_menu(
         target=ContextMenuType.MESSAGE,
@@ -77,14 +68,13 @@ class CommandContextMenus(commands.Cog):
     async def _profile_setup(self, ctx: MenuContext):
         if not await general.correct_channel(ctx, ctx.author):
             return
-        if general_schema.check_setup_exists(ctx.author):
+        expires = profile_service.start_setup(ctx.author)
+        if expires is None:
             return await ctx.send("Setup already in progress. Check your DM's", hidden=True)
-        unique_id = str(uuid.uuid4())
         try:
-            await msg.profile_setup(ctx.author, unique_id)
+            await msg.profile_setup(ctx.author, expires)
         except Exception as e:
             print(e)
-        general_schema.add_profile_setup(ctx.author, str(unique_id), 1)
         embed = discord.Embed(description="Setup has been sent. **Check your DM's**", color=msg.success_color)
         await ctx.send(embed=embed, hidden=True)
 
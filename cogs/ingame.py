@@ -8,7 +8,8 @@ import config
 import cogs.admin
 from cogs.admin import check_admin
 from includes import msg
-from includes.general import correct_channel
+from includes.queue_board import board
+from includes.general import correct_channel, wait_for_rebuild
 from models.ingame_models import SwapResult, SwapError
 from models.profile import Outcome
 from models.queue_models import Queue
@@ -67,6 +68,7 @@ class Ingame(commands.Cog):
         if not await correct_channel(ctx, ctx.author):
             return
 
+        await wait_for_rebuild(ctx)
         game = game_service.finish(ctx.author, Outcome(outcome))
 
         if game is None:
@@ -134,6 +136,7 @@ class Ingame(commands.Cog):
                 member_schema.check_profile(user)
                 # sub player
                 ingame_schema.sub_player(user, member)
+                board.refresh(self.bot)
                 embed = discord.Embed(description=f"**{user.name}** has subbed **{member.name}**")
                 for guild in self.bot.guilds:
                     if guild.name == ctx.guild.name:
@@ -2,10 +2,10 @@ import discord
 from discord.ext import commands
 from discord_slash.context import ComponentContext
 from cogs.shared.add import add
-from includes import msg, custom_ids
-from models.game import GameStatus
+from includes import msg, custom_ids, components
+from includes.general import wait_for_rebuild
 from models.queue_models import Queue
-from schemas import ingame_schema, general_schema, member_schema
+from schemas import ingame_schema
 from services import game_service, map_service, queue_service
 import config
 
@@ -13,6 +13,20 @@ import config
 class Interaction(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.handlers = {
+            custom_ids.shuffle_teams: self.shuffle_teams,
+            custom_ids.shuffle_map: self.shuffle_map,
+            custom_ids.shuffle_map_1: self.shuffle_one_of_two_maps,
+            custom_ids.shuffle_map_2: self.shuffle_one_of_two_maps,
+            custom_ids.map_choices: self.choose_map,
+            custom_ids.override: self.override,
+            custom_ids.re_add: self.re_add,
+        }
+        for custom_id, handler in self.handlers.items():
+            components.register(custom_id, handler)
+
+    def cog_unload(self):
+        components.unregister(*self.handlers.keys())
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -20,40 +34,14 @@ class Interaction(commands.Cog):
 
     @commands.Cog.listener()
     async def on_component(self, ctx: ComponentContext):
-        interacted_by = ctx.author
-        interaction_id = ctx.custom_id
-
-        if interaction_id == custom_ids.shuffle_teams:
-            # check if user has admin role
-            role = discord.utils.get(ctx.guild.roles, id=config.variables['bittah_admin_role'])
-            if role not in interacted_by.roles:
-                if not ingame_schema.is_ingame(interacted_by):
-                    await msg.not_ingame(ctx)
-                    return
-                if not game_service.is_captain(interacted_by):
-                    await msg.captains_only(ctx)
-                    return
-
-            game_id = ingame_schema.get_game_id_from_user(interacted_by)
-            game = game_service.get(game_id)
-
-            if game.reshuffles > 3:
-                await msg.no_more_shuffles(ctx)
-                return
+        if not await components.dispatch(ctx):
+            await msg.expired(ctx)
 
-            game = game_service.shuffle_teams(game_id)
-            await msg.new_game_started(ctx, self.bot, game, interacted_by)
-        elif interaction_id == custom_ids.shuffle_map:
-            if not ingame_schema.is_ingame(interacted_by):
-                await msg.not_ingame(ctx)
-                return
-            if not game_service.is_captain(interacted_by):
-                await msg.captains_only(ctx)
-                return
-            game_id = ingame_schema.get_game_id_from_user(interacted_by)
-            new_maps = ingame_schema.new_map(game_id, map_service.get_maps(num_maps=1), 1)
-            await msg.show_updated_maps(ctx, new_maps, interacted_by, 1)
-        elif interaction_id == custom_ids.shuffle_map_1 or interaction_id == custom_ids.shuffle_map_2:
+    async def shuffle_teams(self, ctx: ComponentContext):
+        interacted_by = ctx.author
+        # check if user has admin role
+        role = discord.utils.get(ctx.guild.roles, id=config.variables['bittah_admin_role'])
+        if role not in interacted_by.roles:
             if not ingame_schema.is_ingame(interacted_by):
                 await msg.not_ingame(ctx)
                 return
@@ -61,59 +49,77 @@ class Interaction(commands.Cog):
                 await msg.captains_only(ctx)
                 return
 
-            game_id = ingame_schema.get_game_id_from_user(interacted_by)
-            new_maps = ingame_schema.new_map(game_id, map_service.get_maps(num_maps=1), interaction_id)
-            await msg.show_updated_maps(ctx, new_maps, interacted_by, 2)
-        elif interaction_id == custom_ids.map_choices:
-            if not ingame_schema.is_ingame(interacted_by):
-                await msg.not_ingame(ctx)
-                return
-            if not game_service.is_captain(interacted_by):
-                await msg.captains_only(ctx)
-                return
-            else:
-                game_id = ingame_schema.get_game_id_from_user(interacted_by)
-                game = ingame_schema.get_game(game_id)
-                old_map = game['maps'][0]
-                ingame_schema.choose_different_map(game_id, ctx.selected_options[0])
-                await msg.display_chosen_map(ctx, game, old_map, ctx.selected_options[0])
-        elif interaction_id == custom_ids.override:
-            game_id = ctx.selected_options[0]
-            game_service.flip_results(game_id)
-            await msg.result_flipped(ctx, game_id)
-
-        elif general_schema.check_custom_id_exists(interaction_id):
-            # Get stage
-            stage = general_schema.get_message_stage(interaction_id)
-            if stage == 1:
-                region = ctx.selected_options[0]
-                member_schema.check_profile(ctx.author)
-                member_schema.update_member_region(ctx.author, region)
-                general_schema.update_stage(interaction_id, ctx.author, 2)
-
-                await msg.stage1_profile_setup(ctx, interaction_id)
-
-            elif stage == 2:
-                member_schema.check_profile(ctx.author)
-                member_schema.update_player_position_new(ctx.author, ctx.selected_options[0])
-                general_schema.update_stage(interaction_id, ctx.author, 3)
-
-                await msg.stage2_profile_setup(ctx, interaction_id)
-            elif stage == 3:
-                member_schema.check_profile(ctx.author)
-                member_schema.update_stats_visibility(ctx.author, ctx.selected_options[0])
-                general_schema.remove_setup(interaction_id)
-
-                await msg.complete_setup(ctx)
-        elif interaction_id == custom_ids.re_add:
-            queue = Queue("quickplay")
-            if not queue_service.valid_for_re_add(ctx.author):
-                await msg.expired(ctx)
-                return
+        game_id = ingame_schema.get_game_id_from_user(interacted_by)
+        game = game_service.get(game_id)
+
+        if game.reshuffles > 3:
+            await msg.no_more_shuffles(ctx)
+            return
 
-            await add(ctx, self.bot, queue)
-        else:
+        game = game_service.shuffle_teams(game_id)
+        await msg.new_game_started(ctx, self.bot, game, interacted_by)
+
+    async def shuffle_map(self, ctx: ComponentContext):
+        interacted_by = ctx.author
+        if not ingame_schema.is_ingame(interacted_by):
+            await msg.not_ingame(ctx)
+            return
+        if not game_service.is_captain(interacted_by):
+            await msg.captains_only(ctx)
+            return
+        game_id = ingame_schema.get_game_id_from_user(interacted_by)
+        new_maps = ingame_schema.new_map(game_id, self.pick_other_map(game_id), 1)
+        map_service.record_played(game_id, new_maps)
+        await msg.show_updated_maps(ctx, new_maps, interacted_by, 1)
+
+    async def shuffle_one_of_two_maps(self, ctx: ComponentContext):
+        interacted_by = ctx.author
+        if not ingame_schema.is_ingame(interacted_by):
+            await msg.not_ingame(ctx)
+            return
+        if not game_service.is_captain(interacted_by):
+            await msg.captains_only(ctx)
+            return
+
+        game_id = ingame_schema.get_game_id_from_user(interacted_by)
+        new_maps = ingame_schema.new_map(game_id, self.pick_other_map(game_id), ctx.custom_id)
+        map_service.record_played(game_id, new_maps)
+        await msg.show_updated_maps(ctx, new_maps, interacted_by, 2)
+
+    async def choose_map(self, ctx: ComponentContext):
+        interacted_by = ctx.author
+        if not ingame_schema.is_ingame(interacted_by):
+            await msg.not_ingame(ctx)
+            return
+        if not game_service.is_captain(interacted_by):
+            await msg.captains_only(ctx)
+            return
+
+        game_id = ingame_schema.get_game_id_from_user(interacted_by)
+        game = ingame_schema.get_game(game_id)
+        old_map = game['maps'][0]
+        ingame_schema.choose_different_map(game_id, ctx.selected_options[0])
+        map_service.record_played(game_id, [ctx.selected_options[0]])
+        await msg.display_chosen_map(ctx, game, old_map, ctx.selected_options[0])
+
+    @staticmethod
+    def pick_other_map(game_id):
+        game = ingame_schema.get_game(game_id)
+        return map_service.get_maps(num_maps=1, exclude=set(game['maps']), queue=Queue(game['queue']))
+
+    async def override(self, ctx: ComponentContext):
+        game_id = ctx.selected_options[0]
+        await wait_for_rebuild(ctx)
+        game_service.flip_results(game_id)
+        await msg.result_flipped(ctx, game_id)
+
+    async def re_add(self, ctx: ComponentContext):
+        queue = Queue("quickplay")
+        if not queue_service.valid_for_re_add(ctx.author):
             await msg.expired(ctx)
+            return
+
+        await add(ctx, self.bot, queue)
 
 
 def setup(bot):
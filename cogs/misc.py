@@ -1,3 +1,5 @@
+from datetime import datetime
+
 import discord
 from discord.ext import commands
 from discord_slash import cog_ext
@@ -6,12 +8,9 @@ from discord_slash.utils.manage_commands import create_option
 
 import config
 from includes import msg
-from includes.general import correct_channel
-from models import twitch
-from services import analytics_service
-
-twitch_streams = twitch.TwitchStreams(config.variables['twitch_client_id'], config.variables['twitch_client_secret'],
-                                      config.variables['twitch_game_id'])
+from includes.general import correct_channel, wait_for_rebuild
+from schemas import member_schema
+from services import analytics_service, ladder_service, stream_service
 
 
 class Misc(commands.Cog):
@@ -40,19 +39,89 @@ class Misc(commands.Cog):
                 required=False,
                 option_type=4,
                 choices=[2022, 2021]
+            ),
+            create_option(
+                name="days",
+                description="Only the last few days",
+                required=False,
+                option_type=4,
+                choices=[1, 7, 14, 30]
             )
         ],
     )
-    async def _leaderboard(self, ctx: SlashContext, month=None, year=None):
+    async def _leaderboard(self, ctx: SlashContext, month=None, year=None, days=None):
         if not await correct_channel(ctx, ctx.author):
             return
 
-        leaderboard = analytics_service.get_leaderboard(year, month)
+        await wait_for_rebuild(ctx)
+        if days is not None:
+            leaderboard = analytics_service.get_leaderboard_for_last_days(days)
+        else:
+            leaderboard = analytics_service.get_leaderboard(year, month)
         if leaderboard is None:
             await msg.invalid_date(ctx)
             return
         await msg.show_leaderboard(ctx, leaderboard)
 
+    @cog_ext.cog_slash(
+        name="mapstats",
+        description="Shows plays, side winrates and game length per map",
+        guild_ids=config.variables['guild_ids'],
+        options=[
+            create_option(
+                name="month",
+                description="Pick a month",
+                required=False,
+                option_type=4,
+                choices=[num for num in range(1, 13)]
+            ),
+            create_option(
+                name="year",
+                description="Pick a year",
+                required=False,
+                option_type=4,
+                choices=[2022, 2021]
+            )
+        ],
+    )
+    async def _mapstats(self, ctx: SlashContext, month=None, year=None):
+        if not await correct_channel(ctx, ctx.author):
+            return
+
+        await wait_for_rebuild(ctx)
+        map_stats = analytics_service.get_map_stats(year, month)
+        if month is not None:
+            title = f"{month}/{year or datetime.now().year}"
+        else:
+            title = str(year) if year is not None else "All Time"
+        await msg.show_map_stats(ctx, title, map_stats, analytics_service.suggest_map_weights(map_stats))
+
+    @cog_ext.cog_slash(
+        name="ladder",
+        description="Shows the skill ladder",
+        guild_ids=config.variables['guild_ids'],
+        options=[
+            create_option(
+                name="page",
+                description="Page number, defaults to your own",
+                required=False,
+                option_type=4
+            )
+        ],
+    )
+    async def _ladder(self, ctx: SlashContext, page=None):
+        if not await correct_channel(ctx, ctx.author):
+            return
+
+        pages = ladder_service.page_count()
+        if page is None:
+            page = ladder_service.page_of(ctx.author.id) or 1
+        page = min(max(page, 1), pages)
+        entries = ladder_service.get_page(page)
+        profiles = member_schema.get_profiles_by_ids([entry.user_id for entry in entries])
+        await msg.show_ladder(ctx, entries, profiles, page, pages, ladder_service.position(ctx.author.id),
+                              ladder_service.percentile(ctx.author.id), ladder_service.size())
+
     @cog_ext.cog_slash(
         name="version",
         description="Shows the bot version",
@@ -82,14 +151,11 @@ class Misc(commands.Cog):
         guild_ids=config.variables['guild_ids']
     )
     async def _streams(self, ctx: SlashContext):
-        await ctx.defer()
-        try:
-            streams = twitch_streams.get_streams()
-        except Exception as e:
-            print(e)
-        if 'data' in streams and streams['data']:
+        # Answered from the poller's snapshot, so Helix usage doesn't depend on how often this is run
+        streams = stream_service.get_top_streams()
+        if streams:
             embed = discord.Embed(color=msg.accent_color)
-            for stream in streams['data']:
+            for stream in streams:
                 embed.add_field(
                     name=f"{stream['viewer_count']} <:views:887829020719333407> {stream['user_name']} - {stream['title']}",
                     value=f"[twitch.tv/{stream['user_name']}](https://twitch.tv/{stream['user_name']})", inline=False)
@@ -2,15 +2,16 @@ from datetime import datetime
 
 import discord
 import timeago
-import uuid
+import time
 from discord.ext import commands
 from discord_slash import cog_ext
-from discord_slash.context import SlashContext
+from discord_slash.context import SlashContext, ComponentContext
 from discord_slash.utils.manage_commands import create_option, create_choice
 
 import config
-from includes import general, msg
-from schemas import member_schema, general_schema
+from includes import general, msg, components, custom_ids
+from schemas import member_schema
+from services import profile_service
 
 import cogs.admin
 from cogs.admin import check_admin, check_admin_member
@@ -19,6 +20,10 @@ from cogs.admin import check_admin, check_admin_member
 class Profile(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        components.register_prefix(custom_ids.setup, self.setup_step)
+
+    def cog_unload(self):
+        components.unregister(custom_ids.setup)
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -77,6 +82,9 @@ class Profile(commands.Cog):
             embed.add_field(name="Position", value=f"**`{profile['position']}`**", inline=True)
             if not profile['hideRank']:
                 embed.add_field(name="W/L/T*", value=f"**`{profile_stats[0]}/{profile_stats[1]}/{profile_stats[2]}`**")
+                if profile.get('streak'):
+                    streak = profile['streak']
+                    embed.add_field(name="Streak", value=f"**`{'W' if streak > 0 else 'L'}{abs(streak)}`**")
             else:
                 embed.add_field(name="W/L/T*", value=f"**`Hidden`**")
         else:
@@ -115,6 +123,9 @@ class Profile(commands.Cog):
             embed.add_field(name="Position", value=f"**`{profile['position']}`**", inline=True)
             if not profile['hideRank']:
                 embed.add_field(name="W/L/T*", value=f"**`{profile_stats[0]}/{profile_stats[1]}/{profile_stats[2]}`**")
+                if profile.get('streak'):
+                    streak = profile['streak']
+                    embed.add_field(name="Streak", value=f"**`{'W' if streak > 0 else 'L'}{abs(streak)}`**")
             else:
                 embed.add_field(name="W/L/T*", value=f"**`Hidden`**")
 
@@ -128,14 +139,37 @@ class Profile(commands.Cog):
     async def _setup(self, ctx:SlashContext):
         if await general.correct_channel(ctx, ctx.author) == False:
             return
-        if general_schema.check_setup_exists(ctx.author):
+        expires = profile_service.start_setup(ctx.author)
+        if expires is None:
             return await ctx.send("Setup already in progress. Check your DM's", hidden=True)
-        unique_id = str(uuid.uuid4())
-        general_schema.add_profile_setup(ctx.author, str(unique_id), 1)
-        await msg.profile_setup(ctx.author, unique_id)
+        await msg.profile_setup(ctx.author, expires)
         embed = discord.Embed(description="Setup has been sent. **Check your DM's**", color=msg.success_color)
         await ctx.send(embed=embed, hidden=True)
 
+    async def setup_step(self, ctx: ComponentContext):
+        # Stage, owner and expiry travel in the signed custom id, so the wizard keeps no database state
+        parts = components.decode_signed(ctx.custom_id)
+        if parts is None or int(parts[1]) != ctx.author.id:
+            await msg.expired(ctx)
+            return
+        stage, expires = parts[0], int(parts[2])
+        if expires < time.time():
+            profile_service.finish_setup(ctx.author)
+            await msg.setup_expired(ctx)
+            return
+
+        member_schema.check_profile(ctx.author)
+        if stage == "1":
+            member_schema.update_member_region(ctx.author, ctx.selected_options[0])
+            await msg.stage1_profile_setup(ctx, expires)
+        elif stage == "2":
+            member_schema.update_player_position_new(ctx.author, ctx.selected_options[0])
+            await msg.stage2_profile_setup(ctx, expires)
+        elif stage == "3":
+            member_schema.update_stats_visibility(ctx.author, ctx.selected_options[0])
+            profile_service.finish_setup(ctx.author)
+            await msg.complete_setup(ctx)
+
 
 def setup(bot):
     bot.add_cog(Profile(bot))
@@ -1,10 +1,10 @@
-import discord
 from discord.ext import commands
 from discord_slash import cog_ext, SlashContext
 
 import config
 from cogs.shared.add import add
 from includes import msg, general
+from includes.queue_board import board
 from models.queue_models import Queue as QueueEnum
 from schemas import queue_schema
 from cogs.admin import check_admin
@@ -54,18 +54,9 @@ class Queue(commands.Cog):
         user = ctx.author
         if not await general.correct_channel(ctx, user):
             return
-        queues = [QueueEnum.QUICKPLAY.value]
-        embed = discord.Embed(color=msg.success_color)
-        for q in queues:
-            is_live = queue_schema.queue_is_ingame(q)
-            players = []
-            for player in queue_schema.get_queue_players(q):
-                players.append(f"**`{player['username'][:14]}`**")
-            embed.add_field(
-                name=f"{config.variables['live'] if is_live else ''}**{q.upper()}** **`[{queue_schema.get_queue_count(QueueEnum(q))}/10]`**",
-                value="**`OPEN`**" if len(players) < 1 else '\n'.join(players))
-
-        await ctx.send(embed=embed)
+        if board.embed is None:
+            await board.update(self.bot)
+        await msg.queue_status(ctx, board.embed, board.jump_url(ctx.guild.id))
 
 
 def setup(cog):
@@ -22,8 +22,7 @@ async def add(ctx, bot, queue: Queue):
             game = game_service.start_game(user, queue)
 
             await msg.game_started(ctx, bot, game)
-            for player in game.team1_players + game.team2_players:
-                await msg.game_started_dm(bot, player.user_id)
+            msg.game_started_dms(bot, [player.user_id for player in game.get_all_players()])
             return
         else:
             raise ValueError("Invalid queue?")
@@ -6,9 +6,9 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
-def getenv_int(key) -> int:
+def getenv_int(key, default: int = None) -> int:
     value = getenv(key)
-    return None if value is None else int(value)
+    return default if value is None else int(value)
 
 
 def getenv_list_int(key) -> List[int]:
@@ -24,6 +24,7 @@ variables = {
     "mongo_connection_string": getenv("BITTAH_MONGO_CONNECTION_STRING", "localhost:27017"),
     "mongo_database_name": getenv("BITTAH_MONGO_DATABASE_NAME", "Bittah"),
     "token": getenv("BITTAH_DISCORD_TOKEN"),
+    "component_secret": getenv("BITTAH_COMPONENT_SECRET"),
     "main_guild": getenv("BITTAH_DISCORD_MAIN_GUILD"),
     "main_guild_id": getenv_int("BITTAH_DISCORD_MAIN_GUILD_ID"),
     "channel": getenv("BITTAH_DISCORD_CHANNEL"),
@@ -33,15 +34,30 @@ variables = {
     "twitch_client_id": getenv("TWITCH_CLIENT_ID"),
     "twitch_client_secret": getenv("TWITCH_CLIENT_SECRET"),
     "twitch_game_id": getenv_int("TWITCH_GAME_ID"),
+    "twitch_auth_url": getenv("TWITCH_AUTH_URL", "https://id.twitch.tv/oauth2"),
+    "twitch_api_url": getenv("TWITCH_API_URL", "https://api.twitch.tv/helix"),
+    "twitch_streams_ttl": getenv_int("TWITCH_STREAMS_SECONDS", 30),
+    "twitch_poll_seconds": getenv_int("TWITCH_POLL_SECONDS", 60),
+    "twitch_live_channel_id": getenv_int("TWITCH_LIVE_CHANNEL_ID"),
     "bittah_access_role": getenv_int("BITTAH_ACCESS_ROLE_ID"),
     "bittah_admin_role": getenv_int("BITTAH_ADMIN_ROLE_ID"),
     "bittah_sa_role": getenv_int("BITTAH_SUPERADMIN_ROLE_ID"),
     "auto_remove": getenv_int("QUEUE_EXPIRE_MINUTES"),
-    "expire_message": getenv_int("QUEUE_EXPIRE_MESSAGES"),
+    "expire_message": getenv_int("QUEUE_EXPIRE_MESSAGES", 5),
     "num_offense_needed": getenv_int("NUM_OFFENSE_NEEDED"),
     "num_chase_needed": getenv_int("NUM_CHASE_NEEDED"),
     "num_home_needed": getenv_int("NUM_HOME_NEEDED"),
     "needs_access": getenv_int("QUEUE_ROLE_ACCESS"),
+    "queue_announce_window": getenv_int("QUEUE_ANNOUNCE_SECONDS", 5),
+    "queue_board_throttle": getenv_int("QUEUE_BOARD_SECONDS", 5),
+    "http_port": getenv_int("HTTP_PORT", 8080),
+    "health_stale_seconds": getenv_int("HEALTH_STALE_SECONDS", 60),
+    "lag_sample_seconds": getenv_int("LAG_SAMPLE_SECONDS", 1),
+    "stall_threshold_ms": getenv_int("STALL_THRESHOLD_MS", 250),
+    "loop_debug": getenv_int("LOOP_DEBUG", 0),
+    "map_cooldown_games": getenv_int("MAP_COOLDOWN_GAMES", 2),
+    # "max" picks the server with the best worst-case ping, "mean" the best average ping
+    "server_objective": getenv("SERVER_OBJECTIVE", "max"),
     "avail": ":green_square:",
     "taken": ":red_square:",
     "live": ":green_circle:",
@@ -76,6 +92,14 @@ map_imgs = {
     "yolandi": "https://i.imgur.com/WwkEDgj.png",
 }
 
+# Suggested server -> expected ping (ms) for players from each profile region
+server_pings = {
+    "Chicago PUG": {"NA": 50, "EU": 110, "AUS": 200},
+    "Los Angeles PUG": {"NA": 50, "EU": 150, "AUS": 160},
+    "London PUG": {"NA": 90, "EU": 25, "AUS": 270},
+    "Sydney Optimised PUG": {"NA": 170, "EU": 280, "AUS": 20},
+}
+
 
 def queues():
     return [{"name": "Quickplay", "value": "quickplay"}]
@@ -0,0 +1,99 @@
+import asyncio
+from typing import Dict, Optional
+
+import discord
+
+import config
+from includes import metrics
+from includes.colors import success_color, error_color
+from includes.general import run_in_background
+from includes.outbound import scheduler, Priority
+from includes.queue_board import board
+from models.queue_models import MAX_QUEUE_SIZE
+
+
+class QueueChange:
+    def __init__(self, name: str, added: bool, mention_id: Optional[int] = None, note: str = None):
+        self.name = name
+        self.added = added
+        self.mention_id = mention_id
+        self.note = note
+
+
+class QueueAnnouncer:
+    """
+    Buffers queue membership changes and publishes them as one combined message per guild every `window` seconds,
+    e.g. "+A +B -C [7/10]". An add and a remove of the same player inside one window cancel out.
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        # queue -> username -> change, insertion ordered
+        self._changes: Dict[str, Dict[str, QueueChange]] = {}
+        self._counts: Dict[str, int] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def queue_changed(self, bot, queue: str, change: QueueChange, queue_count: int):
+        changes = self._changes.setdefault(queue, {})
+        previous = changes.pop(change.name, None)
+        if previous is None or previous.added == change.added:
+            changes[change.name] = change
+        self._counts[queue] = queue_count
+        metrics.inc("queue_announcements_buffered_total", queue=queue)
+        board.refresh(bot)
+
+        if self._flush_task is None:
+            self._flush_task = run_in_background(self._flush_later(bot))
+
+    def clear(self, queue: str):
+        """
+        Drops pending changes for a queue, e.g. when a game start message supersedes them.
+        """
+        self._changes.pop(queue, None)
+        self._counts.pop(queue, None)
+
+    async def _flush_later(self, bot):
+        try:
+            if self.window > 0:
+                await asyncio.sleep(self.window)
+        finally:
+            self._flush_task = None
+        await self.flush(bot)
+
+    async def flush(self, bot):
+        changes, counts = self._changes, self._counts
+        self._changes, self._counts = {}, {}
+        changes = {queue: queue_changes for queue, queue_changes in changes.items() if queue_changes}
+        if not changes:
+            return
+
+        content, embed = self.render(changes, counts)
+        for guild in bot.guilds:
+            channel = discord.utils.get(guild.text_channels, name=config.variables['channel'])
+            if channel is not None:
+                scheduler.send(channel, Priority.QUEUE_NOTICE, content=content, embed=embed)
+                metrics.inc("queue_announcements_sent_total")
+
+    @staticmethod
+    def render(changes: Dict[str, Dict[str, QueueChange]], counts: Dict[str, int]):
+        lines = []
+        mentions = []
+        net_added = 0
+        for queue, queue_changes in changes.items():
+            parts = []
+            for change in queue_changes.values():
+                part = f"**+{change.name}**" if change.added else f"**−{change.name}**"
+                parts.append(f"{part} ({change.note})" if change.note else part)
+                net_added += 1 if change.added else -1
+                if change.mention_id is not None:
+                    mentions.append(f"<@!{change.mention_id}>")
+            lines.append(f"**`{queue}`** {' '.join(parts)}")
+
+        content = " ".join([f"**`{queue} [{counts[queue]}/{MAX_QUEUE_SIZE}]`**" for queue in changes.keys()])
+        if mentions:
+            content = f"{content} {' '.join(mentions)}"
+        embed = discord.Embed(description="\n".join(lines), color=success_color if net_added >= 0 else error_color)
+        return content, embed
+
+
+announcer = QueueAnnouncer(config.variables['queue_announce_window'])
@@ -0,0 +1,69 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from includes import metrics
+
+_MISSING = object()
+# Names of every cache created, for the hit ratio gauges
+_names = set()
+
+
+class TTLCache:
+    """
+    Bounded LRU mapping whose entries expire `ttl` seconds after they were set.
+    Hits and misses are counted under `cache_hits_total` / `cache_misses_total` with the cache's name as a label.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        _names.add(name)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key, _MISSING)
+        if entry is not _MISSING:
+            expires, value = entry
+            if expires > time.monotonic():
+                self._data.move_to_end(key)
+                metrics.inc("cache_hits_total", cache=self.name)
+                return value
+            del self._data[key]
+        metrics.inc("cache_misses_total", cache=self.name)
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key, _MISSING)
+        return entry is not _MISSING and entry[0] > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def hit_rate(self) -> Optional[float]:
+        hits = metrics.get("cache_hits_total", cache=self.name)
+        misses = metrics.get("cache_misses_total", cache=self.name)
+        return None if hits + misses == 0 else hits / (hits + misses)
+
+
+@metrics.collector
+def _hit_ratio_gauges():
+    for name in _names:
+        hits = metrics.get("cache_hits_total", cache=name)
+        misses = metrics.get("cache_misses_total", cache=name)
+        if hits + misses:
+            metrics.set_gauge("cache_hit_ratio", hits / (hits + misses), cache=name)
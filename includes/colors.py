@@ -0,0 +1,3 @@
+success_color = 0x84ff00
+error_color = 0xfc0303
+accent_color = 0xebe534
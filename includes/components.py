@@ -0,0 +1,111 @@
+import hashlib
+import hmac
+import os
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from discord_slash.context import ComponentContext
+
+import config
+from includes import metrics, query_stats
+from includes.loader import request_scope
+
+SEPARATOR = ":"
+SIGNATURE_LENGTH = 16
+
+# Without a configured secret, signed ids only stay valid until the bot restarts
+_secret = (config.variables['component_secret'] or os.urandom(32).hex()).encode()
+
+Handler = Callable[[ComponentContext], Awaitable]
+
+# Fixed custom ids (includes/custom_ids) and custom id prefixes, each mapped to the handler a cog registered
+_exact: Dict[str, Handler] = {}
+_prefixes: Dict[str, Handler] = {}
+
+
+def encode(prefix: str, *parts) -> str:
+    """
+    Builds a prefix-encoded custom id, e.g. encode("setup", 2, nonce) -> "setup:2:<nonce>"
+    """
+    return SEPARATOR.join([prefix, *[str(part) for part in parts]])
+
+
+def decode(custom_id: str) -> List[str]:
+    """
+    :return: The parts after the prefix
+    """
+    return custom_id.split(SEPARATOR)[1:]
+
+
+def encode_signed(prefix: str, *parts) -> str:
+    """
+    Like encode, with a trailing HMAC so state carried in the custom id can't be forged by the client
+    """
+    unsigned = encode(prefix, *parts)
+    return encode(unsigned, _sign(unsigned))
+
+
+def decode_signed(custom_id: str) -> Optional[List[str]]:
+    """
+    :return: The parts after the prefix, or None if the signature doesn't match
+    """
+    unsigned, _, signature = custom_id.rpartition(SEPARATOR)
+    if not hmac.compare_digest(_sign(unsigned), signature):
+        return None
+    return decode(unsigned)
+
+
+def _sign(value: str) -> str:
+    return hmac.new(_secret, value.encode(), hashlib.sha256).hexdigest()[:SIGNATURE_LENGTH]
+
+
+def register(custom_id: str, handler: Handler):
+    if custom_id in _exact:
+        raise ValueError(f"Component handler already registered for {custom_id}")
+    _exact[custom_id] = handler
+
+
+def register_prefix(prefix: str, handler: Handler):
+    if SEPARATOR in prefix:
+        raise ValueError(f"Prefix can't contain '{SEPARATOR}'")
+    if prefix in _prefixes:
+        raise ValueError(f"Component handler already registered for prefix {prefix}")
+    _prefixes[prefix] = handler
+
+
+def unregister(*keys: str):
+    for key in keys:
+        _exact.pop(key, None)
+        _prefixes.pop(key, None)
+
+
+def route(custom_id: str) -> Optional[str]:
+    """
+    :return: The registry key that handles the custom id, or None if nothing does
+    """
+    if custom_id in _exact:
+        return custom_id
+    prefix = custom_id.split(SEPARATOR, 1)[0]
+    if prefix != custom_id and prefix in _prefixes:
+        return prefix
+    return None
+
+
+async def dispatch(ctx: ComponentContext) -> bool:
+    """
+    :return: False if no handler is registered for the component's custom id
+    """
+    key = route(ctx.custom_id)
+    if key is None:
+        metrics.inc("component_unknown_total")
+        return False
+
+    metrics.inc("component_dispatch_total", route=key)
+    handler = _exact[key] if key in _exact else _prefixes[key]
+    try:
+        with request_scope(), metrics.timed("component_duration_seconds", route=key), \
+                query_stats.operation(f"component:{key}"):
+            await handler(ctx)
+    except Exception:
+        metrics.inc("component_errors_total", route=key)
+        raise
+    return True
@@ -7,3 +7,6 @@ shuffle_map_2 = "15522"
 map_choices = "2432"
 override = "15532"
 re_add = "15533"
+
+# Prefixes for custom ids that carry state, see includes/components
+setup = "setup"
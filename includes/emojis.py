@@ -10,3 +10,4 @@ heavy_plus_sign = ":heavy_plus_sign:"
 avail = ":green_square:"
 pencil = ":pencil:"
 star = ":star:"
+arrow_left = ":arrow_left:"
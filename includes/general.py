@@ -1,9 +1,11 @@
-from typing import Dict
+import asyncio
+from typing import Dict, Coroutine, Set
 
 from discord_slash.context import SlashContext
 
 import config
 from schemas import member_schema
+from services import analytics_service
 
 
 async def correct_channel(ctx: SlashContext, user):
@@ -27,6 +29,16 @@ async def admin_channel(ctx: SlashContext, user):
     return True
 
 
+async def wait_for_rebuild(ctx):
+    """
+    Holds a result write or report read until a running stats rebuild finishes, deferring so the interaction
+    doesn't expire meanwhile
+    """
+    if analytics_service.rebuilding():
+        await ctx.defer()
+        await analytics_service.wait_for_rebuild()
+
+
 def verify_channel(func):
     """
     TODO: this doesn't work with other args
@@ -48,6 +60,20 @@ def verify_channel(func):
     return wrapper
 
 
+# Keeps fire-and-forget tasks referenced until they finish so they aren't garbage collected mid-flight
+_background_tasks: Set[asyncio.Task] = set()
+
+
+def run_in_background(coro: Coroutine) -> asyncio.Task:
+    """
+    Schedules a coroutine on the running loop without waiting for it.
+    """
+    task = asyncio.get_event_loop().create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
 def convert_keys_to_int(dictionary: Dict[str, int]) -> Dict[int, int]:
     return {int(key): value for key, value in dictionary.items()}
 
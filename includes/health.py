@@ -0,0 +1,108 @@
+import asyncio
+import json
+import time
+from typing import Dict, Optional
+
+import discord
+from aiohttp import web
+
+import config
+from includes import metrics
+from includes.mongo import client as mongo_client
+
+STALE_SECONDS = config.variables['health_stale_seconds']
+
+# Background loop name -> monotonic time of its last completed iteration
+_heartbeats: Dict[str, float] = {}
+# Result of the last Mongo ping made by probe_mongo; probes only ever read these
+_mongo_ping_ms: Optional[float] = None
+_mongo_error: Optional[str] = None
+_mongo_checked_at: Optional[float] = None
+
+_runner: Optional[web.AppRunner] = None
+
+
+def heartbeat(name: str):
+    _heartbeats[name] = time.monotonic()
+
+
+def heartbeat_ages() -> Dict[str, float]:
+    now = time.monotonic()
+    return {name: round(now - beat, 3) for name, beat in _heartbeats.items()}
+
+
+async def probe_mongo():
+    """
+    Pings Mongo off the event loop and caches the result for /readyz
+    """
+    global _mongo_ping_ms, _mongo_error, _mongo_checked_at
+    started = time.perf_counter()
+    try:
+        await asyncio.get_event_loop().run_in_executor(None, mongo_client.admin.command, 'ping')
+    except Exception as e:
+        _mongo_ping_ms, _mongo_error = None, f"{type(e).__name__}: {e}"
+    else:
+        _mongo_ping_ms, _mongo_error = (time.perf_counter() - started) * 1000, None
+        metrics.set_gauge("mongo_ping_ms", _mongo_ping_ms)
+    _mongo_checked_at = time.monotonic()
+
+
+def readiness(bot: discord.Client) -> Dict:
+    now = time.monotonic()
+    mongo_age = None if _mongo_checked_at is None else now - _mongo_checked_at
+    mongo_ok = _mongo_error is None and mongo_age is not None and mongo_age < STALE_SECONDS
+    gateway_ok = bot.is_ready() and not bot.is_closed()
+    ages = heartbeat_ages()
+    stale = sorted(name for name, age in ages.items() if age > STALE_SECONDS)
+    return {
+        "ready": mongo_ok and gateway_ok and not stale,
+        "mongo": {"ok": mongo_ok, "ping_ms": _mongo_ping_ms, "error": _mongo_error,
+                  "checked_seconds_ago": None if mongo_age is None else round(mongo_age, 3)},
+        "gateway": {"ok": gateway_ok, "latency_ms": None if not gateway_ok else round(bot.latency * 1000, 3)},
+        "loops": {"heartbeat_ages": ages, "stale": stale},
+    }
+
+
+def _app(bot: discord.Client) -> web.Application:
+    async def healthz(request):
+        return web.json_response({"status": "ok"})
+
+    async def readyz(request):
+        state = readiness(bot)
+        return web.Response(text=json.dumps(state), content_type="application/json",
+                            status=200 if state["ready"] else 503)
+
+    async def metrics_text(request):
+        return web.Response(text=metrics.render(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/", healthz)
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/readyz", readyz)
+    app.router.add_get("/metrics", metrics_text)
+    return app
+
+
+async def start(bot: discord.Client):
+    """
+    Serves the probes on the bot's own loop. Safe to call again on reconnect.
+    """
+    global _runner
+    if _runner is not None:
+        return
+    runner = web.AppRunner(_app(bot), access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, port=config.variables['http_port']).start()
+    except OSError:
+        await runner.cleanup()
+        raise
+    _runner = runner
+
+
+async def stop():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
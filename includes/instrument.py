@@ -0,0 +1,109 @@
+import functools
+import inspect
+from types import FrameType, ModuleType
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from discord_slash import SlashCommand
+
+from includes import components, metrics, query_stats
+
+
+def _timed_coroutine(func: Callable, name: str, **labels) -> Callable:
+    operation = f"{name}:{','.join(map(str, labels.values()))}"
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        metrics.inc(f"{name}_total", **labels)
+        try:
+            with metrics.timed(f"{name}_duration_seconds", **labels), query_stats.operation(operation):
+                return await func(*args, **kwargs)
+        except Exception:
+            metrics.inc(f"{name}_errors_total", **labels)
+            raise
+
+    wrapper.__instrumented__ = True
+    return wrapper
+
+
+def _commands(slash: SlashCommand) -> Iterator[Tuple[str, object]]:
+    for name, command in slash.commands.items():
+        if name == "context":
+            yield from command.items()
+        elif command.func is not None:
+            yield name, command
+    for base, subcommands in slash.subcommands.items():
+        for name, subcommand in subcommands.items():
+            if isinstance(subcommand, dict):
+                for sub_name, grouped in subcommand.items():
+                    yield f"{base} {name} {sub_name}", grouped
+            else:
+                yield f"{base} {name}", subcommand
+
+
+def slash_commands(slash: SlashCommand):
+    """
+    Times every registered slash and context-menu command. Call again after loading more cogs; commands that are
+    already wrapped are skipped.
+    """
+    for name, command in _commands(slash):
+        if not getattr(command.func, "__instrumented__", False):
+            command.func = _timed_coroutine(command.func, "slash_command", command=name)
+
+
+def loop(name: str):
+    """
+    Times each iteration of a background loop; goes under @tasks.loop
+    """
+    def decorator(func: Callable) -> Callable:
+        return _timed_coroutine(func, "loop_iteration", loop=name)
+
+    return decorator
+
+
+def schema_module(module: ModuleType):
+    """
+    Counts and times every public function of a schema module, by replacing the module attributes. Callers use
+    `member_schema.get_profile(...)`, so they pick up the wrapped function without changes.
+    """
+    prefix = module.__name__.rsplit(".", 1)[-1]
+    for name, func in list(vars(module).items()):
+        if (name.startswith("_") or not inspect.isfunction(func) or func.__module__ != module.__name__
+                or getattr(func, "__instrumented__", False)):
+            continue
+        setattr(module, name, _timed_function(func, f"{prefix}.{name}"))
+
+
+def _timed_function(func: Callable, label: str) -> Callable:
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        metrics.inc("schema_calls_total", function=label)
+        with metrics.timed("schema_duration_seconds", function=label), query_stats.function(label):
+            return func(*args, **kwargs)
+
+    wrapper.__instrumented__ = True
+    return wrapper
+
+
+async def _noop():
+    pass
+
+
+# Every wrapper shares its factory's code object, which is how running() spots them on a captured stack
+_COROUTINE_WRAPPER_CODE = _timed_coroutine(_noop, "noop").__code__
+_FUNCTION_WRAPPER_CODE = _timed_function(_noop, "noop").__code__
+
+
+def running(frame: Optional[FrameType]) -> List[str]:
+    """
+    :return: The instrumented commands, components, loops and schema functions on a stack, outermost first
+    """
+    found = []
+    while frame is not None:
+        if frame.f_code is _COROUTINE_WRAPPER_CODE:
+            found.append(frame.f_locals.get('operation'))
+        elif frame.f_code is components.dispatch.__code__:
+            found.append(f"component:{frame.f_locals.get('key')}")
+        elif frame.f_code is _FUNCTION_WRAPPER_CODE:
+            found.append(f"schema:{frame.f_locals.get('label')}")
+        frame = frame.f_back
+    return found[::-1]
@@ -0,0 +1,115 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Generic, Hashable, Iterable, List, Optional, Set, TypeVar
+
+from includes import metrics
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+class _LoaderState:
+    def __init__(self):
+        self.values: Dict = {}
+        self.pending: Set = set()
+
+
+class _Scope:
+    def __init__(self):
+        # loader name -> state for this request
+        self.states: Dict[str, _LoaderState] = {}
+        # Tasks spawned during the request inherit the scope through their copied context and may outlive it;
+        # once closed they load straight from the batch functions or open a scope of their own
+        self.closed = False
+
+
+# The current request (interaction, command or loop iteration). Each asyncio task gets its own copy of the context,
+# so concurrent requests never see each other's memoised values.
+_scope: ContextVar[Optional[_Scope]] = ContextVar('loader_scope', default=None)
+
+
+def _current() -> Optional[_Scope]:
+    current = _scope.get()
+    return None if current is None or current.closed else current
+
+
+@contextmanager
+def request_scope():
+    """
+    Memoises loader results until the block exits. Nested scopes share the outermost one.
+    """
+    if _current() is not None:
+        yield
+        return
+    current = _Scope()
+    token = _scope.set(current)
+    try:
+        yield
+    finally:
+        current.closed = True
+        _scope.reset(token)
+
+
+class BatchLoader(Generic[K, V]):
+    """
+    Collects key lookups made during one request and resolves them with a single call to `batch_fn`.
+    Keys passed to `prefetch` are resolved together on the next `load`; loaded values are memoised for the rest of the
+    request scope. Outside a scope every call goes straight to `batch_fn`.
+    """
+
+    def __init__(self, name: str, batch_fn: Callable[[List[K]], Dict[K, V]]):
+        self.name = name
+        self.batch_fn = batch_fn
+
+    def prefetch(self, keys: Iterable[K]):
+        state = self._state()
+        if state is not None:
+            state.pending.update(key for key in keys if key not in state.values)
+
+    def load(self, key: K) -> Optional[V]:
+        return self.load_many([key]).get(key)
+
+    def load_many(self, keys: Iterable[K]) -> Dict[K, V]:
+        keys = list(dict.fromkeys(keys))
+        state = self._state()
+        if state is None:
+            return self._fetch(keys)
+
+        state.pending.update(key for key in keys if key not in state.values)
+        if state.pending:
+            pending = list(state.pending)
+            state.pending.clear()
+            found = self._fetch(pending)
+            for key in pending:
+                # Misses are memoised too, so a missing key isn't queried again in the same request
+                state.values[key] = found.get(key)
+        return {key: state.values[key] for key in keys if state.values.get(key) is not None}
+
+    def prime(self, key: K, value: V):
+        state = self._state()
+        if state is not None:
+            state.values[key] = value
+            state.pending.discard(key)
+
+    def forget(self, key: K):
+        """
+        Drops a memoised value after a write that didn't update it in place
+        """
+        state = self._state()
+        if state is not None:
+            state.values.pop(key, None)
+
+    def _state(self) -> Optional[_LoaderState]:
+        scope = _current()
+        if scope is None:
+            return None
+        if self.name not in scope.states:
+            scope.states[self.name] = _LoaderState()
+        return scope.states[self.name]
+
+    def _fetch(self, keys: List[K]) -> Dict[K, V]:
+        if not keys:
+            return {}
+        metrics.inc("loader_batches_total", loader=self.name)
+        metrics.inc("loader_keys_total", len(keys), loader=self.name)
+        return self.batch_fn(keys)
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import List, Optional, Tuple
+
+import config
+from includes import instrument, logger, metrics
+
+LAG_SAMPLE_SECONDS = config.variables['lag_sample_seconds']
+STALL_THRESHOLD_SECONDS = config.variables['stall_threshold_ms'] / 1000
+# Event-loop lag is usually far below a command's latency, so it gets finer buckets
+LAG_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+STALL_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+MAX_STACK_FRAMES = 25
+
+# Monotonic time the sampler last woke up; written on the loop, read by the watchdog thread
+_last_tick = 0.0
+# Stack the watchdog captured during the current stall: (tick it belongs to, what was running, formatted stack).
+# Only the watchdog writes it and only the sampler clears it, once the loop is back.
+_capture: Optional[Tuple[float, List[str], str]] = None
+_lag_task: Optional[asyncio.Task] = None
+_watchdog: Optional[threading.Thread] = None
+_slow_callback_handler: Optional[logging.Handler] = None
+
+
+class _SlowCallbackHandler(logging.Handler):
+    """
+    Counts the "Executing <Handle> took N seconds" warnings asyncio logs in debug mode
+    """
+
+    def emit(self, record: logging.LogRecord):
+        if isinstance(record.msg, str) and record.msg.startswith("Executing") and len(record.args or ()) == 2:
+            metrics.inc("slow_callbacks_total")
+            metrics.observe("slow_callback_seconds", record.args[1], buckets=STALL_BUCKETS)
+
+
+def start(loop: asyncio.AbstractEventLoop):
+    """
+    Samples scheduling lag on the loop and watches it from a separate thread, so a stall's stack can be captured
+    while the loop is still blocked. Safe to call again on reconnect.
+    """
+    global _lag_task, _watchdog, _last_tick, _slow_callback_handler
+    _last_tick = time.monotonic()
+    if _lag_task is None or _lag_task.done():
+        _lag_task = loop.create_task(_sample_lag(loop))
+    if _watchdog is None:
+        _watchdog = threading.Thread(target=_watch, args=(threading.get_ident(),), name="loop-watchdog", daemon=True)
+        _watchdog.start()
+
+    if config.variables['loop_debug']:
+        # Debug mode slows the loop down noticeably, so it's opt-in
+        loop.set_debug(True)
+        loop.slow_callback_duration = STALL_THRESHOLD_SECONDS
+        if _slow_callback_handler is None:
+            _slow_callback_handler = _SlowCallbackHandler()
+            logging.getLogger("asyncio").addHandler(_slow_callback_handler)
+
+
+async def _sample_lag(loop: asyncio.AbstractEventLoop):
+    global _last_tick, _capture
+    while True:
+        previous_tick = _last_tick
+        expected = loop.time() + LAG_SAMPLE_SECONDS
+        await asyncio.sleep(LAG_SAMPLE_SECONDS)
+        lag = max(0.0, loop.time() - expected)
+        _last_tick = time.monotonic()
+        metrics.observe("event_loop_lag_seconds", lag, buckets=LAG_BUCKETS)
+        metrics.set_gauge("event_loop_lag_seconds_last", lag)
+
+        if lag < STALL_THRESHOLD_SECONDS:
+            continue
+        capture, _capture = _capture, None
+        # A capture from an earlier stall the watchdog only got to after the loop recovered doesn't apply
+        running, stack = (capture[1], capture[2]) if capture is not None and capture[0] == previous_tick else ([], "")
+        source = running[0] if running else "unknown"
+        metrics.inc("event_loop_stalls_total", source=source)
+        metrics.observe("event_loop_stall_seconds", lag, buckets=STALL_BUCKETS, source=source)
+        logger.log(f"Event loop stalled for {lag:.3f}s in {' > '.join(running) or 'unknown'}\n{stack}",
+                   logging.WARNING)
+
+
+def _watch(loop_thread_id: int):
+    global _capture
+    while True:
+        time.sleep(STALL_THRESHOLD_SECONDS / 2)
+        tick = _last_tick
+        overdue = time.monotonic() - tick - LAG_SAMPLE_SECONDS
+        if overdue < STALL_THRESHOLD_SECONDS or (_capture is not None and _capture[0] == tick):
+            continue
+        frame = sys._current_frames().get(loop_thread_id)
+        if frame is None:
+            continue
+        # One capture per stall, taken as soon as it crosses the threshold
+        _capture = (tick, instrument.running(frame), "".join(traceback.format_stack(frame, limit=MAX_STACK_FRAMES)))
@@ -0,0 +1,123 @@
+import bisect
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, Tuple
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+# Seconds; suits anything from a cached lookup to a slow Mongo aggregation
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# (metric name, sorted label pairs) -> value
+_counters: Dict[Key, float] = defaultdict(float)
+_gauges: Dict[Key, float] = {}
+_histograms: Dict[Key, "_Histogram"] = {}
+# Called before every render, to set gauges that are cheaper to read on demand than to keep up to date
+_collectors: List[Callable[[], None]] = []
+
+
+class _Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _key(name: str, labels: Dict[str, str]) -> Key:
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def inc(name: str, amount: float = 1, **labels):
+    _counters[_key(name, labels)] += amount
+
+
+def set_gauge(name: str, value: float, **labels):
+    _gauges[_key(name, labels)] = value
+
+
+def observe(name: str, value: float, buckets: Sequence[float] = DEFAULT_BUCKETS, **labels):
+    key = _key(name, labels)
+    if key not in _histograms:
+        _histograms[key] = _Histogram(buckets)
+    _histograms[key].observe(value)
+
+
+@contextmanager
+def timed(name: str, **labels):
+    """
+    Observes how long the block took, in seconds, even when it raises
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def collector(fn: Callable[[], None]) -> Callable[[], None]:
+    _collectors.append(fn)
+    return fn
+
+
+def get(name: str, **labels) -> float:
+    key = _key(name, labels)
+    return _gauges[key] if key in _gauges else _counters.get(key, 0)
+
+
+def _label_text(labels: Tuple[Tuple[str, str], ...]) -> str:
+    escaped = [(key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for key, value in labels]
+    return ",".join([f'{key}="{value}"' for key, value in escaped])
+
+
+def _series(name: str, labels: Tuple[Tuple[str, str], ...]) -> str:
+    label_text = _label_text(labels)
+    return f"{name}{{{label_text}}}" if label_text else name
+
+
+def snapshot() -> Dict[str, float]:
+    """
+    :return: Flat copy of every counter and gauge, keyed like `name{label="value"}`
+    """
+    return {_series(name, labels): value for (name, labels), value in [*_counters.items(), *_gauges.items()]}
+
+
+def render() -> str:
+    """
+    :return: Every metric in the Prometheus text exposition format
+    """
+    for fn in _collectors:
+        fn()
+
+    families: Dict[str, Tuple[str, List[str]]] = {}
+
+    def family(name: str, kind: str) -> List[str]:
+        return families.setdefault(name, (kind, []))[1]
+
+    for (name, labels), value in sorted(_counters.items()):
+        family(name, "counter").append(f"{_series(name, labels)} {value}")
+    for (name, labels), value in sorted(_gauges.items()):
+        family(name, "gauge").append(f"{_series(name, labels)} {value}")
+    for (name, labels), histogram in sorted(_histograms.items(), key=lambda item: item[0]):
+        lines = family(name, "histogram")
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f"{_series(f'{name}_bucket', labels + (('le', str(bound)),))} {cumulative}")
+        lines.append(f"{_series(f'{name}_bucket', labels + (('le', '+Inf'),))} {histogram.count}")
+        lines.append(f"{_series(f'{name}_sum', labels)} {histogram.sum}")
+        lines.append(f"{_series(f'{name}_count', labels)} {histogram.count}")
+
+    output = []
+    for name, (kind, lines) in families.items():
+        output.append(f"# TYPE {name} {kind}")
+        output.extend(lines)
+    return "\n".join(output) + "\n"
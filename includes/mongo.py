@@ -1,6 +1,7 @@
 from pymongo import MongoClient
 
 import config
+from includes import query_stats
 
-client = MongoClient(host=config.variables["mongo_connection_string"])
+client = MongoClient(host=config.variables["mongo_connection_string"], event_listeners=[query_stats.CommandListener()])
 db = client[config.variables["mongo_database_name"]]
@@ -1,3 +1,5 @@
+import asyncio
+import logging
 from datetime import datetime
 from typing import Dict, List, Tuple
 
@@ -8,16 +10,18 @@ from discord_slash.model import ButtonStyle
 from discord_slash.utils.manage_components import create_button, create_actionrow, create_select_option, create_select
 
 import config
-from includes import custom_ids, logger, emojis
+from includes import components, custom_ids, logger, emojis, metrics, templates
+from includes.announcer import announcer, QueueChange
+from includes.colors import success_color, error_color, accent_color
+from includes.general import run_in_background
+from includes.outbound import scheduler, Priority
+from includes.queue_board import board
 from models.game import Game, GameStatus, FinishedGame
-from models.leaderboards import Leaderboard
+from models.ladder import LadderEntry
+from models.leaderboards import Leaderboard, MapStats
 from models.queue_models import Queue
 from services import game_service, map_service
 
-success_color = 0x84ff00
-error_color = 0xfc0303
-accent_color = 0xebe534
-
 
 async def error(ctx, msg):
     embed = discord.Embed(description=msg, color=error_color)
@@ -39,23 +43,13 @@ async def already_ingame(ctx):
 
 async def generating_teams(ctx, bot):
     embed = discord.Embed(description=f"{config.variables['live']} **Generating Teams** {config.variables['live']}")
-    await send_in_correct_channel(ctx, bot, embed=embed)
+    await send_in_correct_channel(ctx, bot, embed=embed, priority=Priority.GAME_START)
 
 
 async def added_to_queue(ctx, bot, queue: str, queue_count):
     user = ctx.author
-    '''
-    embed = discord.Embed(description=f"**{user.name}** added to **`{queue}`**", color=success_color)
-    embed.set_author(icon_url=user.avatar_url, name=user.name)
-    embed.set_footer(text=f"Server • {ctx.guild.name}")
-    content = f"**`{queue} [{queue_count}/10]`**"
-    await send_in_correct_channel(ctx, bot, content, embed)
-    '''
-
-    description = f"**{user.name}** added to **`{queue}`**"
-    embed = discord.Embed(description=description, color=success_color)
-    content = f"**`{queue} [{queue_count}/10]`**"
-    await send_in_correct_channel(ctx, bot, content, embed)
+    await success(ctx, f"Added to **`{queue} [{queue_count}/10]`**", hidden=True)
+    announcer.queue_changed(bot, queue, QueueChange(user.name, True), queue_count)
 
 
 async def added_to_queues(ctx, bot, queue_counts: Dict[str, int]):
@@ -71,10 +65,14 @@ async def added_to_queues(ctx, bot, queue_counts: Dict[str, int]):
 
 async def removed_from_single_queue(ctx, bot, queue, queue_count):
     user = ctx.author
-    description = f"**{user.name}** removed from **`{queue}`**"
-    embed = discord.Embed(description=description, color=error_color)
-    content = f"**`{queue} [{queue_count}/10]`**"
-    await send_in_correct_channel(ctx, bot, content, embed)
+    embed = discord.Embed(description=f"Removed from **`{queue} [{queue_count}/10]`**", color=error_color)
+    await ctx.send(embed=embed, hidden=True)
+    announcer.queue_changed(bot, queue, QueueChange(user.name, False), queue_count)
+
+
+def auto_removed_from_queue(bot, user_id, username, queue, queue_count):
+    note = f"idle {config.variables['auto_remove']}m"
+    announcer.queue_changed(bot, queue, QueueChange(username, False, mention_id=user_id, note=note), queue_count)
 
 
 async def removed_from_all_queues(ctx, bot, queue_counts: Dict[str, int]):
@@ -85,56 +83,94 @@ async def removed_from_all_queues(ctx, bot, queue_counts: Dict[str, int]):
     await send_in_correct_channel(ctx, bot, content, embed)
 
 
-async def send_in_correct_channel(ctx, bot, content: str = None, embed: Embed = None, components=None):
-    for guild in bot.guilds:
-        if ctx.guild is None or ctx.guild.name != guild.name:
-            channel = discord.utils.get(guild.text_channels, name=config.variables['channel'])
-            if channel is not None:
-                await channel.send(content=content, embed=embed, components=components)
-        else:
-            await ctx.send(content=content, embed=embed, components=components)
+async def send_in_correct_channel(ctx, bot, content: str = None, embed: Embed = None, components=None,
+                                  priority: Priority = Priority.INTERACTION):
+    """
+    Replies to the interaction, then queues the same message for the other guilds' channels without waiting on them.
+    """
+    is_origin = [ctx.guild is not None and ctx.guild.name == guild.name for guild in bot.guilds]
+    if any(is_origin):
+        await ctx.send(content=content, embed=embed, components=components)
+
+    for guild, origin in zip(bot.guilds, is_origin):
+        if origin:
+            continue
+        channel = discord.utils.get(guild.text_channels, name=config.variables['channel'])
+        if channel is not None:
+            scheduler.send(channel, priority, content=content, embed=embed, components=components)
+
+
+def game_started_dms(bot, user_ids: List[int]):
+    """
+    Sends the game start DMs in the background so the game start reply doesn't wait on them.
+    """
+    run_in_background(send_game_started_dms(bot, user_ids))
+
+
+async def send_game_started_dms(bot, user_ids: List[int]):
+    # The outbound scheduler limits concurrency and keeps DMs behind channel messages
+    results = await asyncio.gather(*[game_started_dm(bot, user_id) for user_id in user_ids])
+    if not all(results):
+        logger.log(f"Game start DMs: {results.count(True)}/{len(results)} delivered", logging.WARNING)
 
 
-async def game_started_dm(bot, user_id):
+async def game_started_dm(bot, user_id) -> bool:
     body = f"Hey there! Your game **has started**! Check the **`{config.variables['main_guild']}`** server for comms."
     embed = discord.Embed(description=body, color=success_color)
 
+    async def send():
+        # Cached lookup first; fetch_user is a REST call
+        player = bot.get_user(user_id) or await bot.fetch_user(user_id)
+        return await player.send(embed=embed)
+
     try:
-        player = await bot.fetch_user(user_id)
-        await player.send(embed=embed)
-    except:
-        return
+        await scheduler.submit(("dm", user_id), Priority.DM, send)
+    except discord.HTTPException as e:
+        metrics.inc("dm_failed_total", kind="game_started", reason=type(e).__name__)
+        logger.log(f"Game start DM to {user_id} failed: {e}", logging.WARNING)
+        return False
 
+    metrics.inc("dm_sent_total", kind="game_started")
+    return True
 
-async def game_started(ctx, bot, game: Game):
-    suggested_server = game_service.pick_suggested_server(game.get_all_players())
-    game_service.update_game_server(game.game_id, suggested_server)
-    buttons = [
+
+@templates.template("shuffle_teams")
+def _shuffle_teams_row():
+    return create_actionrow(
         create_button(
             style=ButtonStyle.green,
             label="Shuffle Teams",
             custom_id=custom_ids.shuffle_teams
-        ),
-    ]
-    maps = create_select(
-        options=[
-            create_select_option(map_name, value=map_name) for map_name in map_service.get_all_map_names_alphabetical()
-        ],
-        custom_id=custom_ids.map_choices,
-        placeholder="Any captain, choose a map",
-        min_values=1,
-        max_values=1,
+        )
     )
 
-    button_action_row = create_actionrow(*buttons)
-    maps = game.maps
 
-    content = f"**`{str(game.queue.value).capitalize()} Game Started`**"
+@templates.template("map_select", version=lambda: map_service.version)
+def _map_select_row():
+    return create_actionrow(
+        create_select(
+            options=[
+                create_select_option(map_name, value=map_name)
+                for map_name in map_service.get_all_map_names_alphabetical()
+            ],
+            custom_id=custom_ids.map_choices,
+            placeholder="Any captain, choose a map",
+            min_values=1,
+            max_values=1,
+        )
+    )
 
-    body = f"""
-        **`Maps:`** {', '.join(maps)}
+
+@templates.template("game_started", fillable=True)
+def _game_started_embed():
+    return discord.Embed(title="Game Started", color=success_color)
+
+
+def _fill_game_embed(game: Game) -> Embed:
+    embed = templates.get("game_started")
+    embed.description = f"""
+        **`Maps:`** {', '.join(game.maps)}
     """
-    embed = discord.Embed(title="Game Started", description=body, color=success_color)
     team1_captain = f"{config.variables['rank_red']} **`{game.team1_captain.name[:14]}`**"
     team2_captain = f"{config.variables['rank_red']} **`{game.team2_captain.name[:14]}`**"
 
@@ -150,14 +186,25 @@ async def game_started(ctx, bot, game: Game):
     embed.add_field(name=f"{team1_captain}", value='\n'.join(team1_players))
     embed.add_field(name=f"{team2_captain}", value='\n'.join(team2_players))
 
-    if maps[0].lower() in config.map_imgs:
-        embed.set_thumbnail(url=config.map_imgs[maps[0].lower()])
+    if game.maps[0].lower() in config.map_imgs:
+        embed.set_thumbnail(url=config.map_imgs[game.maps[0].lower()])
+    return embed
+
+
+async def game_started(ctx, bot, game: Game):
+    # The game start embed lists the roster, so pending queue changes are stale
+    announcer.clear(game.queue.value)
+    board.refresh(bot)
+    suggested_server = game_service.pick_suggested_server(game.get_all_players())
+    game_service.update_game_server(game.game_id, suggested_server)
 
-    await send_in_correct_channel(ctx, bot, content=content, embed=embed,
-                                  components=[button_action_row])
+    content = f"**`{str(game.queue.value).capitalize()} Game Started`**"
+    await send_in_correct_channel(ctx, bot, content=content, embed=_fill_game_embed(game),
+                                  components=[templates.get("shuffle_teams")], priority=Priority.GAME_START)
 
 
 async def display_chosen_map(ctx, game, old_map, _map):
+    board.refresh(ctx.bot)
     body = f"""
         A new map has been selected for **`{game['queue']}`**.
     """
@@ -172,53 +219,30 @@ async def display_chosen_map(ctx, game, old_map, _map):
 
 
 async def new_game_started(ctx, bot, game: Game, user):
-    suggested_server = game_service.get_game_server(game.game_id)
-    buttons = [
-        create_button(
-            style=ButtonStyle.green,
-            label="Shuffle Teams",
-            custom_id=custom_ids.shuffle_teams
-        ),
-    ]
-    maps = create_select(
-        options=[
-            create_select_option(map_name, value=map_name) for map_name in map_service.get_all_map_names_alphabetical()
-        ],
-        custom_id=custom_ids.map_choices,
-        placeholder="Any captain, choose a map",
-        min_values=1,
-        max_values=1,
-    )
-
-    button_action_row = create_actionrow(*buttons)
-    maps_action_row = create_actionrow(maps)
-    maps = game.maps
+    board.refresh(bot)
 
-    body = f"""
-        **`Maps:`** {', '.join(maps)}
-    """
-    embed = discord.Embed(title="Game Started", description=body, color=success_color)
-    team1_captain = f"{config.variables['rank_red']} **`{game.team1_captain.name[:14]}`**"
-    team2_captain = f"{config.variables['rank_red']} **`{game.team2_captain.name[:14]}`**"
+    content = f"**`Reshuffled by {user.name}`**"
+    await send_in_correct_channel(ctx, bot, content=content, embed=_fill_game_embed(game),
+                                  components=[templates.get("shuffle_teams"), templates.get("map_select")],
+                                  priority=Priority.GAME_START)
 
-    team1_players = []
-    team2_players = []
 
-    for player in game.team1_others:
-        team1_players.append(
-            f"{config.variables['rank']} **`{player.name[:14]}`**")
-    for player in game.team2_others:
-        team2_players.append(
-            f"{config.variables['rank']} **`{player.name[:14]}`**")
-    embed.add_field(name=f"{team1_captain}", value='\n'.join(team1_players))
-    embed.add_field(name=f"{team2_captain}", value='\n'.join(team2_players))
+def streams_went_live(bot, streams: List[Dict]):
+    channel = bot.get_channel(config.variables['twitch_live_channel_id'] or 0)
+    if channel is None:
+        return
+    for stream in streams:
+        embed = discord.Embed(
+            title=f"{stream['user_name']} is live",
+            description=f"{stream['title']}\n[twitch.tv/{stream['user_login']}](https://twitch.tv/{stream['user_login']})",
+            color=accent_color
+        )
+        scheduler.send(channel, Priority.QUEUE_NOTICE, embed=embed)
 
-    if maps[0].lower() in config.map_imgs:
-        embed.set_thumbnail(url=config.map_imgs[maps[0].lower()])
 
-    content = f"**`Reshuffled by {user.name}`**"
-    await send_in_correct_channel(ctx, bot, content=content, embed=embed,
-                                  components=[button_action_row, maps_action_row])
+async def queue_status(ctx, embed: Embed, jump_url: str = None):
+    content = f"Live board: {jump_url}" if jump_url else None
+    await ctx.send(content=content, embed=embed.copy(), hidden=True)
 
 
 async def not_ingame(ctx):
@@ -264,11 +288,13 @@ async def games_info(ctx, games: List[Game]):
 
 
 async def swapped(ctx, bot, user_name, target_name):
+    board.refresh(bot)
     embed = discord.Embed(description=f"**{user_name}** swapped teams with **{target_name}**")
     await send_in_correct_channel(ctx, bot, embed=embed)
 
 
-async def help_text(ctx):
+@templates.template("help")
+def _help_embed():
     body = f"""
     **Queue**
     `/status`: Check the status of the selected queue(s)
@@ -293,8 +319,11 @@ async def help_text(ctx):
     `/purge`: Clear bot messages for 8 hours
     `/shutdown`: Shut the bot down
     """
-    embed = discord.Embed(description=body, color=accent_color)
-    await ctx.send(embed=embed, hidden=True)
+    return discord.Embed(description=body, color=accent_color)
+
+
+async def help_text(ctx):
+    await ctx.send(embed=templates.get("help"), hidden=True)
 
 
 async def maps_updated(ctx, maps):
@@ -302,13 +331,14 @@ async def maps_updated(ctx, maps):
 
 
 async def show_updated_maps(ctx, maps, user, num_maps):
+    board.refresh(ctx.bot)
     if num_maps == 1:
         buttons = [
             create_actionrow(
                 create_button(
                     style=ButtonStyle.green,
                     label="Shuffle Again",
-                    custom_id="15529"
+                    custom_id=custom_ids.shuffle_map
                 )
             )
         ]
@@ -318,12 +348,12 @@ async def show_updated_maps(ctx, maps, user, num_maps):
                 create_button(
                     style=ButtonStyle.green,
                     label="Shuffle Map 1",
-                    custom_id="15521"
+                    custom_id=custom_ids.shuffle_map_1
                 ),
                 create_button(
                     style=ButtonStyle.green,
                     label="Shuffle Map 2",
-                    custom_id="15522"
+                    custom_id=custom_ids.shuffle_map_2
                 )
             )
         ]
@@ -338,6 +368,7 @@ async def incorrect_map_number(ctx, maps):
 
 
 async def game_finished(ctx, bot, queue: Queue, started_at: datetime, ended_at: datetime, outcome: str):
+    board.refresh(bot)
     game_time = timeago.format(started_at, ended_at)
     description = f"{queue.name} game has **finished**. Game time: **`{game_time.replace(' ago', '')}`**"
 
@@ -402,6 +433,46 @@ async def show_leaderboard(ctx, leaderboard: Leaderboard):
     await ctx.send(embed=embed, hidden=True)
 
 
+async def show_ladder(ctx, entries: List[LadderEntry], profiles: Dict[int, dict], page: int, pages: int,
+                      position, percentile, total: int):
+    lines = []
+    for entry in entries:
+        profile = profiles.get(entry.user_id, {})
+        # Players who hide their rank keep their place on the ladder, but not their name
+        if entry.user_id == ctx.author.id or not profile.get('hideRank', True):
+            name = profile.get('username', "Unknown")
+        else:
+            name = "Hidden"
+        line = f"**`#{entry.position}`** {name} **`{entry.score:.1f}`**"
+        lines.append(f"{line} {emojis.arrow_left}" if entry.user_id == ctx.author.id else line)
+
+    embed = discord.Embed(title="Ladder", description="\n".join(lines) if lines else "N/A", color=accent_color)
+    footer = f"Page {page}/{pages}"
+    if position is not None:
+        footer += f" • You are #{position} of {total}, ahead of {percentile:.0f}% of players"
+    embed.set_footer(text=footer)
+    await ctx.send(embed=embed, hidden=True)
+
+
+async def show_map_stats(ctx, title: str, map_stats: List[MapStats], suggested_weights: Dict[str, float]):
+    embed = discord.Embed(title=f"Map Stats - {title}", color=accent_color)
+    for stats in map_stats[:25]:
+        sides = "N/A" if stats.team1_winrate is None \
+            else f"{stats.team1_winrate:.0%} / {1 - stats.team1_winrate:.0%}"
+        duration = "N/A" if stats.average_duration_seconds is None \
+            else f"{round(stats.average_duration_seconds / 60)}m"
+        value = f"""
+            **`Plays:`** {stats.plays}
+            **`Team 1 / Team 2:`** {sides}
+            **`Average length:`** {duration}
+            **`Suggested weight:`** {suggested_weights.get(stats.name, "N/A")}
+        """
+        embed.add_field(name=stats.name, value=value)
+    if not map_stats:
+        embed.description = "No games in this period"
+    await ctx.send(embed=embed, hidden=True)
+
+
 async def invalid_date(ctx):
     await ctx.send("Invalid date.", hidden=True)
 
@@ -439,12 +510,14 @@ def bold_mono(text):
 
 
 async def cancel_game_message(ctx, user):
+    board.refresh(ctx.bot)
     embed = discord.Embed(title="Game Canceled", description=f"**{user.name}** has canceled the game",
                           color=error_color)
     await ctx.send(embed=embed)
 
 
 async def force_remove_from_queue(ctx, admin, member):
+    board.refresh(ctx.bot)
     embed = discord.Embed(description=f"**{admin.name}** removed **{member}** from queue", color=accent_color)
     await ctx.send(embed=embed)
 
@@ -504,14 +577,14 @@ async def result_flipped(ctx, game_id):
     await ctx.send(embed=embed)
 
 
-async def profile_setup(user, unique_id):
+async def profile_setup(user, expires: int):
     regions = create_select(
         options=[
             create_select_option("NA", value="NA"),
             create_select_option("EU", value="EU"),
             create_select_option("AUS", value="AUS"),
         ],
-        custom_id=unique_id,
+        custom_id=components.encode_signed(custom_ids.setup, 1, user.id, expires),
         placeholder="Choose a region",
         min_values=1,
         max_values=1,
@@ -521,8 +594,8 @@ async def profile_setup(user, unique_id):
 
     body = """
         Hi! Let's setup your profile.
-        First, **select your region**. You have **2 minutes** before this message expires
-    """
+        First, **select your region**. You have **{minutes} minutes** before this message expires
+    """.format(minutes=config.variables['expire_message'])
     embed = discord.Embed(title="Setup Profile", description=body, color=0xff00d4)
 
     try:
@@ -531,7 +604,7 @@ async def profile_setup(user, unique_id):
         print(e)
 
 
-async def stage1_profile_setup(ctx, id):
+async def stage1_profile_setup(ctx, expires: int):
     positions = create_select(
         options=[
             create_select_option("Offense", value="Offense"),
@@ -539,7 +612,7 @@ async def stage1_profile_setup(ctx, id):
             create_select_option("Home Defense", value="Home Defense"),
             create_select_option("Flexible", value="Flexible"),
         ],
-        custom_id=id,
+        custom_id=components.encode_signed(custom_ids.setup, 2, ctx.author.id, expires),
         placeholder="Choose a position",
         min_values=1,
         max_values=1,
@@ -552,13 +625,13 @@ async def stage1_profile_setup(ctx, id):
     await ctx.send(embed=embed, components=[position_action_row])
 
 
-async def stage2_profile_setup(ctx, id):
+async def stage2_profile_setup(ctx, expires: int):
     show_stats = create_select(
         options=[
             create_select_option("Show Stats", value="Show"),
             create_select_option("Hide Stats", value="Hide"),
         ],
-        custom_id=id,
+        custom_id=components.encode_signed(custom_ids.setup, 3, ctx.author.id, expires),
         placeholder="Choose a selection",
         min_values=1,
         max_values=1,
@@ -580,6 +653,11 @@ async def complete_setup(ctx):
     await ctx.send(embed=embed)
 
 
+async def setup_expired(ctx):
+    embed = discord.Embed(description="Profile setup has expired. Use **`/setup`** again to restart")
+    await ctx.send(embed=embed, hidden=True)
+
+
 async def no_more_shuffles(ctx):
     await ctx.send("3 shuffles maximum. Try swapping?", hidden=True)
 
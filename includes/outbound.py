@@ -0,0 +1,207 @@
+import asyncio
+import logging
+from collections import deque
+from enum import IntEnum
+from typing import Awaitable, Callable, Deque, Dict, Hashable, Optional
+
+import discord
+
+from includes import logger, metrics
+
+# Discord allows 5 messages per 5 seconds per channel and 50 requests per second globally
+ROUTE_CAPACITY = 5
+ROUTE_PERIOD = 5.0
+GLOBAL_CAPACITY = 50
+GLOBAL_PERIOD = 1.0
+MAX_CONCURRENT_SENDS = 8
+MAX_RETRIES = 3
+
+
+class Priority(IntEnum):
+    GAME_START = 0
+    INTERACTION = 1
+    QUEUE_NOTICE = 2
+    DM = 3
+
+
+class TokenBucket:
+    def __init__(self, capacity: int, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = 0.0
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        if self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """
+        :return: Seconds until a token is available, 0 if one is available now
+        """
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def rate_limited(self, retry_after: float, now: float):
+        """
+        Syncs the bucket with a 429: no tokens until Discord's reset time has passed.
+        """
+        self.tokens = 0
+        self.updated = now + retry_after
+        self.blocked_until = now + retry_after
+
+
+class OutboundJob:
+    def __init__(self, route: Hashable, priority: Priority, send: Callable[[], Awaitable], future: asyncio.Future,
+                 enqueued: float):
+        self.route = route
+        self.priority = priority
+        self.send = send
+        self.future = future
+        self.enqueued = enqueued
+        self.attempts = 0
+
+
+class OutboundScheduler:
+    """
+    Sends outbound Discord requests in priority order (game start > interaction replies > queue notices > DMs),
+    holding each route to its own token bucket so one busy channel doesn't delay the others.
+    """
+
+    def __init__(self):
+        self._queues: Dict[Priority, Deque[OutboundJob]] = {priority: deque() for priority in Priority}
+        self._buckets: Dict[Hashable, TokenBucket] = {}
+        self._global = TokenBucket(GLOBAL_CAPACITY, GLOBAL_PERIOD)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def submit(self, route: Hashable, priority: Priority, send: Callable[[], Awaitable]) -> asyncio.Future:
+        """
+        :param route: Rate limit key, e.g. ("channel", channel.id)
+        :param send: Zero-argument callable returning the awaitable that performs the request
+        :return: Future resolved with the request's result
+        """
+        loop = asyncio.get_event_loop()
+        self._ensure_started(loop)
+        future = loop.create_future()
+        future.add_done_callback(_retrieve_exception)
+        self._queues[priority].append(OutboundJob(route, priority, send, future, loop.time()))
+        self._publish_depth()
+        self._wakeup.set()
+        return future
+
+    def send(self, channel: discord.abc.Messageable, priority: Priority, **kwargs) -> asyncio.Future:
+        return self.submit(("channel", channel.id), priority, lambda: channel.send(**kwargs))
+
+    def depth(self) -> Dict[str, int]:
+        return {priority.name.lower(): len(queue) for priority, queue in self._queues.items()}
+
+    def _ensure_started(self, loop):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(MAX_CONCURRENT_SENDS)
+            self._dispatcher = loop.create_task(self._dispatch())
+
+    def _bucket(self, route: Hashable) -> TokenBucket:
+        if route not in self._buckets:
+            self._buckets[route] = TokenBucket(ROUTE_CAPACITY, ROUTE_PERIOD)
+        return self._buckets[route]
+
+    def _next_ready(self, now: float):
+        """
+        :return: The highest priority job whose route has a token, otherwise None and the shortest wait
+        """
+        global_delay = self._global.delay(now)
+        if global_delay > 0:
+            return None, global_delay
+
+        shortest = None
+        for priority in Priority:
+            for job in self._queues[priority]:
+                delay = self._bucket(job.route).delay(now)
+                if delay == 0:
+                    self._queues[priority].remove(job)
+                    return job, None
+                shortest = delay if shortest is None else min(shortest, delay)
+        return None, shortest
+
+    async def _dispatch(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await self._slots.acquire()
+            now = loop.time()
+            job, wait = self._next_ready(now)
+            if job is None:
+                self._slots.release()
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._bucket(job.route).take(now)
+            self._global.take(now)
+            self._publish_depth()
+            loop.create_task(self._execute(job))
+
+    async def _execute(self, job: OutboundJob):
+        loop = asyncio.get_event_loop()
+        job.attempts += 1
+        try:
+            result = await job.send()
+        except discord.HTTPException as e:
+            if e.status == 429 and job.attempts < MAX_RETRIES:
+                self._bucket(job.route).rate_limited(retry_after(e), loop.time())
+                self._queues[job.priority].appendleft(job)
+                metrics.inc("outbound_rate_limited_total", priority=job.priority.name.lower())
+                self._wakeup.set()
+                return
+            metrics.inc("outbound_failed_total", priority=job.priority.name.lower())
+            logger.log(f"Outbound {job.priority.name} request to {job.route} failed: {e}", logging.WARNING)
+            if not job.future.done():
+                job.future.set_exception(e)
+            return
+        except Exception as e:
+            metrics.inc("outbound_failed_total", priority=job.priority.name.lower())
+            logger.log(f"Outbound {job.priority.name} request to {job.route} failed: {e}", logging.ERROR)
+            if not job.future.done():
+                job.future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+
+        metrics.inc("outbound_sent_total", priority=job.priority.name.lower())
+        metrics.inc("outbound_wait_seconds_total", loop.time() - job.enqueued, priority=job.priority.name.lower())
+        if not job.future.done():
+            job.future.set_result(result)
+
+    def _publish_depth(self):
+        for priority, queue in self._queues.items():
+            metrics.set_gauge("outbound_queue_depth", len(queue), priority=priority.name.lower())
+
+
+def retry_after(e: discord.HTTPException) -> float:
+    headers = getattr(e.response, 'headers', None) or {}
+    for header in ("X-RateLimit-Reset-After", "Retry-After"):
+        if header in headers:
+            return float(headers[header])
+    return ROUTE_PERIOD
+
+
+def _retrieve_exception(future: asyncio.Future):
+    # Failures are logged by the scheduler; this keeps fire-and-forget sends from warning about unretrieved exceptions
+    if not future.cancelled():
+        future.exception()
+
+
+scheduler = OutboundScheduler()
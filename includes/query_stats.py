@@ -0,0 +1,113 @@
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional, Set
+
+from pymongo import monitoring
+
+from includes import logger, metrics
+
+# Round trips and documents are small integers, so they get count buckets rather than the default seconds ones
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+UNATTRIBUTED = "none"
+
+
+class _Operation:
+    def __init__(self, name: str, trace: bool):
+        self.name = name
+        self.round_trips = 0
+        self.documents = 0
+        self.trace: Optional[List[str]] = [] if trace else None
+        # Tasks spawned during the operation inherit it through their copied context and may outlive it;
+        # their queries are unattributed rather than charged to an operation whose totals were already recorded
+        self.closed = False
+
+
+# The slash command, component or loop iteration the current task is running, and the innermost schema function.
+# pymongo calls the listener synchronously on the thread that issued the command, so these are the caller's values.
+_operation: ContextVar[Optional[_Operation]] = ContextVar('mongo_operation', default=None)
+_function: ContextVar[Optional[str]] = ContextVar('mongo_function', default=None)
+# Operation names whose next invocation logs its full query sequence
+_trace_next: Set[str] = set()
+
+
+def trace_next(name: str):
+    _trace_next.add(name)
+
+
+def _current() -> Optional[_Operation]:
+    current = _operation.get()
+    return None if current is None or current.closed else current
+
+
+@contextmanager
+def operation(name: str):
+    """
+    Attributes the Mongo commands issued inside the block to `name`. Nested blocks count towards the outermost.
+    """
+    if _current() is not None:
+        yield
+        return
+    current = _Operation(name, trace=name in _trace_next)
+    _trace_next.discard(name)
+    token = _operation.set(current)
+    try:
+        yield
+    finally:
+        current.closed = True
+        _operation.reset(token)
+        metrics.observe("mongo_round_trips_per_operation", current.round_trips, buckets=COUNT_BUCKETS,
+                        operation=name)
+        metrics.observe("mongo_documents_per_operation", current.documents, buckets=COUNT_BUCKETS, operation=name)
+        if current.trace is not None:
+            logger.log(f"Mongo trace for {name}: {current.round_trips} round trips, {current.documents} documents\n"
+                       + "\n".join(current.trace), logging.INFO)
+
+
+@contextmanager
+def function(name: str):
+    token = _function.set(name)
+    try:
+        yield
+    finally:
+        _function.reset(token)
+
+
+def _returned_documents(reply: dict) -> int:
+    cursor = reply.get('cursor')
+    if isinstance(cursor, dict):
+        return len(cursor.get('firstBatch', cursor.get('nextBatch', [])))
+    if 'value' in reply:
+        # findAndModify
+        return 0 if reply['value'] is None else 1
+    return int(reply.get('n', 0))
+
+
+class CommandListener(monitoring.CommandListener):
+    def started(self, event: monitoring.CommandStartedEvent):
+        current = _current()
+        if current is None:
+            return
+        current.round_trips += 1
+        if current.trace is not None:
+            collection = event.command.get(event.command_name)
+            current.trace.append(f"{current.round_trips}. {event.command_name} {collection} "
+                                 f"from {_function.get() or UNATTRIBUTED}")
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        current = _current()
+        documents = _returned_documents(event.reply)
+        labels = {
+            'operation': current.name if current is not None else UNATTRIBUTED,
+            'function': _function.get() or UNATTRIBUTED,
+        }
+        if current is not None:
+            current.documents += documents
+        metrics.inc("mongo_commands_total", command=event.command_name, **labels)
+        metrics.inc("mongo_documents_total", documents, command=event.command_name, **labels)
+        metrics.observe("mongo_command_seconds", event.duration_micros / 1e6, command=event.command_name)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        current = _current()
+        metrics.inc("mongo_command_failures_total", command=event.command_name,
+                    operation=current.name if current is not None else UNATTRIBUTED)
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import discord
+import timeago
+
+import config
+from includes import logger, metrics
+from includes.colors import success_color
+from includes.general import run_in_background
+from includes.loader import request_scope
+from includes.outbound import scheduler, Priority
+from models.game import GameStatus
+from models.queue_models import QueueStatus, MAX_QUEUE_SIZE
+from services import queue_service
+
+BOARD_TITLE = "Queue Board"
+
+
+def render(statuses: List[QueueStatus]) -> discord.Embed:
+    embed = discord.Embed(title=BOARD_TITLE, color=success_color, timestamp=datetime.utcnow())
+    for status in statuses:
+        queue = status.queue.value
+        players = [f"**`{username[:14]}`**" for username in status.usernames]
+        embed.add_field(
+            name=f"{config.variables['live'] if status.is_live else ''}**{queue.upper()}** **`[{status.count}/{MAX_QUEUE_SIZE}]`**",
+            value="**`OPEN`**" if len(players) < 1 else '\n'.join(players))
+
+        for game in status.live_games:
+            if game.status == GameStatus.STARTED:
+                value = f"""
+                    **`Captains:`** {game.get_team1_captain_name()} vs {game.get_team2_captain_name()}
+                    **`Maps:`** {', '.join(game.maps)}
+                    **`{timeago.format(game.started_at, datetime.now())}`**
+                    """
+            else:
+                value = f"**`Players:`** {', '.join([player.name for player in game.unassigned_players])}"
+            embed.add_field(name=f"{config.variables['live']} **{queue.upper()} GAME**", value=value, inline=False)
+
+    embed.set_footer(text="Updated")
+    return embed
+
+
+class QueueBoard:
+    """
+    One pinned message per guild showing every queue, edited in place at most once every `throttle` seconds.
+    """
+
+    def __init__(self, throttle: int):
+        self.throttle = throttle
+        self.embed: Optional[discord.Embed] = None
+        self._message_ids: Dict[int, int] = {}
+        self._jump_urls: Dict[int, str] = {}
+        self._update_task: Optional[asyncio.Task] = None
+        self._dirty = False
+        self._last_update = 0.0
+
+    def refresh(self, bot):
+        """
+        Marks the board as stale. Bursts of changes collapse into one edit per throttle interval.
+        """
+        self._dirty = True
+        if self._update_task is None:
+            self._update_task = run_in_background(self._update_later(bot))
+
+    def jump_url(self, guild_id: int) -> Optional[str]:
+        return self._jump_urls.get(guild_id)
+
+    async def _update_later(self, bot):
+        try:
+            loop = asyncio.get_event_loop()
+            while self._dirty:
+                # Refreshes that arrived during the last edit wait out the rest of its interval too
+                wait = self._last_update + self.throttle - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self._dirty = False
+                self._last_update = loop.time()
+                await self.update(bot)
+        finally:
+            self._update_task = None
+
+    async def update(self, bot):
+        with request_scope():
+            self.embed = render(queue_service.get_status())
+        metrics.inc("queue_board_renders_total")
+        for guild in bot.guilds:
+            channel = discord.utils.get(guild.text_channels, name=config.variables['channel'])
+            if channel is None:
+                continue
+            try:
+                await scheduler.submit(("channel", channel.id), Priority.QUEUE_NOTICE,
+                                       lambda channel=channel: self._publish(bot, channel))
+            except discord.HTTPException as e:
+                logger.log(f"Queue board update in {guild.name} failed: {e}", logging.WARNING)
+
+    async def _publish(self, bot, channel):
+        message_id = self._message_ids.get(channel.guild.id)
+        if message_id is not None:
+            try:
+                await channel.get_partial_message(message_id).edit(embed=self.embed)
+                return
+            except discord.NotFound:
+                self._message_ids.pop(channel.guild.id)
+
+        message = await self._find_pinned(bot, channel)
+        if message is None:
+            message = await channel.send(embed=self.embed)
+            await message.pin()
+        else:
+            await message.edit(embed=self.embed)
+        self._message_ids[channel.guild.id] = message.id
+        self._jump_urls[channel.guild.id] = message.jump_url
+
+    @staticmethod
+    async def _find_pinned(bot, channel) -> Optional[discord.Message]:
+        for message in await channel.pins():
+            if message.author == bot.user and message.embeds and message.embeds[0].title == BOARD_TITLE:
+                return message
+        return None
+
+
+board = QueueBoard(config.variables['queue_board_throttle'])
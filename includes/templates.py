@@ -0,0 +1,65 @@
+import copy
+from typing import Any, Callable, Dict, Hashable, Set, Tuple
+
+from includes import metrics
+
+Builder = Callable[[], Any]
+
+# Template name -> builder and the function whose result says when the built payload went stale
+_builders: Dict[str, Tuple[Builder, Callable[[], Hashable]]] = {}
+# Templates callers fill in; only these are copied on get, the rest are shared and must be treated as read-only
+_fillable: Set[str] = set()
+# Template name -> (version it was built at, payload)
+_built: Dict[str, Tuple[Hashable, Any]] = {}
+
+
+def template(name: str, version: Callable[[], Hashable] = lambda: None, fillable: bool = False):
+    """
+    Registers a builder for a static payload (component dict or embed), rebuilt only when `version()` changes
+    :param fillable: Callers modify what get returns, so each call gets its own copy
+    """
+    def decorator(builder: Builder) -> Builder:
+        if name in _builders:
+            raise ValueError(f"Template already registered for {name}")
+        _builders[name] = (builder, version)
+        if fillable:
+            _fillable.add(name)
+        return builder
+
+    return decorator
+
+
+def get(name: str) -> Any:
+    """
+    :return: The prebuilt payload, or for fillable templates a copy the caller is free to fill in
+    """
+    builder, version = _builders[name]
+    current = version()
+    built = _built.get(name)
+    if built is None or built[0] != current:
+        built = _build(name, builder, current)
+    return _clone(built[1]) if name in _fillable else built[1]
+
+
+def build_all():
+    for name, (builder, version) in _builders.items():
+        _build(name, builder, version())
+
+
+def invalidate(*names: str):
+    """
+    Forces a rebuild on next use, e.g. after a config change. Without names, every template is rebuilt.
+    """
+    for name in names or list(_built):
+        _built.pop(name, None)
+
+
+def _build(name: str, builder: Builder, current: Hashable) -> Tuple[Hashable, Any]:
+    metrics.inc("template_builds_total", template=name)
+    _built[name] = (current, builder())
+    return _built[name]
+
+
+def _clone(payload: Any) -> Any:
+    # Embed.copy shares the fields list with the original, so add_field on it would leak into the template
+    return copy.deepcopy(payload)
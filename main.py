@@ -1,61 +1,98 @@
 import datetime
-import threading
+import logging
 from glob import glob
 from pathlib import PurePath
 
 import discord
 from discord.ext import commands, tasks
 from discord_slash import SlashCommand
-from simple_http_server import server, request_map
 
 import config
-from schemas import queue_schema, general_schema
+from includes import health, instrument, logger, loop_monitor, metrics, msg, templates
+from includes.queue_board import board
+from models.queue_models import Queue
+from schemas import queue_schema, member_schema, ingame_schema, analytics_schema
+from services import analytics_service, ladder_service, map_service, stream_service
 
 COGS = [PurePath(path).stem for path in glob("./cogs/*.py")]
 
-client = commands.Bot(command_prefix="=")
+
+class Bittah(commands.Bot):
+    async def close(self):
+        # client.run calls this on every way out, including SIGINT/SIGTERM; the gateway disconnects regardless
+        try:
+            try:
+                await health.stop()
+            finally:
+                await stream_service.close()
+        finally:
+            await super().close()
+
+
+client = Bittah(command_prefix="=")
 slash = SlashCommand(client, sync_commands=True)
 
+# Services and cogs call schema functions through the module, so wrapping the attributes times every call
+for schema in (queue_schema, member_schema, ingame_schema, analytics_schema):
+    instrument.schema_module(schema)
+
 
 @tasks.loop(seconds=5)
+@instrument.loop("autoremove")
 async def autoremove():
     result = queue_schema.get_all_queue_players()
+    # Already read every queued player, so the queue size gauges come for free
+    for queue in Queue:
+        metrics.set_gauge("queue_players", sum(player['queue'] == queue.value for player in result), queue=queue.value)
     for player in result:
         added = player['added']
         if added < datetime.datetime.now() - datetime.timedelta(minutes=config.variables['auto_remove']):
             queue_schema.auto_remove_from_queue(player['userId'])
-            for guild in client.guilds:
-                channel = discord.utils.get(guild.text_channels, name=config.variables['channel'])
-                embed = discord.Embed(
-                    description=f"Removed **{player['username']}** from **`{player['queue']}`** after **{config.variables['auto_remove']}** minutes",
-                    color=0xfc0303)
-                if channel is not None:
-                    await channel.send(embed=embed, content=f"<@!{player['userId']}>")
+            msg.auto_removed_from_queue(client, player['userId'], player['username'], player['queue'],
+                                        queue_schema.get_queue_count(Queue(player['queue'])))
+    health.heartbeat("autoremove")
 
 
+# Ticks often so backoff delays are honoured closely; stream_service decides when a poll is actually due
 @tasks.loop(seconds=5)
-async def autoremove_expired_messages():
-    messages = general_schema.get_all_setup_messages()
-    for message in messages:
-        if message['created'] < datetime.datetime.now() - datetime.timedelta(minutes=config.variables['expire_message']):
-            embed = discord.Embed(description="Profile setup has expired. Use **`/setup`** again to restart")
-            user = await client.fetch_user(message['userId'])
-            await user.send(embed=embed)
-            general_schema.remove_setup(message['uniqueueId'])
+@instrument.loop("stream_poller")
+async def stream_poller():
+    went_live = await stream_service.poll()
+    if went_live:
+        msg.streams_went_live(client, went_live)
+    health.heartbeat("stream_poller")
+
+
+# Keeps /readyz answering from cached state; the probes themselves never touch Mongo
+@tasks.loop(seconds=15)
+@instrument.loop("health_probe")
+async def health_probe():
+    await health.probe_mongo()
 
 
 @client.event
 async def on_ready():
     print(f"BITTAH ONLINE | VERSION: {config.variables['version']}")
     print(discord.__version__)
+    member_schema.ensure_indexes()
+    analytics_schema.ensure_indexes()
+    # Commands are served as soon as this yields, so the in-memory state they read is loaded before the first await
+    member_schema.load_banned()
+    ingame_schema.load_live_games()
+    ladder_service.load()
+    map_service.load_recent_maps()
+    templates.build_all()
     await client.change_presence(activity=discord.Game(name="Midair 2"))
     autoremove.start()
-    autoremove_expired_messages.start()
-
-
-@request_map("/")
-def healthcheck():
-    return {"status": "All good!"}
+    health_probe.start()
+    loop_monitor.start(client.loop)
+    if stream_service.enabled():
+        stream_poller.start()
+    board.refresh(client)
+    player_stats_missing = not member_schema.player_stats_exist()
+    rollups_missing = not analytics_schema.rollups_exist()
+    if player_stats_missing or rollups_missing:
+        await analytics_service.rebuild(player_stats=player_stats_missing, rollups=rollups_missing)
 
 
 def run_bot():
@@ -66,14 +103,14 @@ def run_bot():
         if filename.endswith('.py'):
             client.load_extension(f'cogs.{filename[:-3]}')
     '''
+    instrument.slash_commands(slash)
+    # Up before login so /healthz answers while the gateway connects; /readyz reports 503 until it has
+    try:
+        client.loop.run_until_complete(health.start(client))
+    except OSError as e:
+        logger.log(f"Health server couldn't listen on port {config.variables['http_port']}: {e}", logging.ERROR)
     client.run(config.variables['token'])
 
 
-def run_server():
-    server.start(port=8080)
-
-
 if __name__ == "__main__":
-    server_thread = threading.Thread(target=run_server)
-    server_thread.start()
     run_bot()
@@ -0,0 +1,8 @@
+class LadderEntry:
+    def __init__(self, user_id: int, position: int, score: float):
+        self.user_id = user_id
+        self.position = position
+        self.score = score
+
+    def __repr__(self):
+        return f"LadderEntry(user_id={self.user_id}, position={self.position}, score={self.score:.2f})"
@@ -28,14 +28,15 @@ class PlayerStatsInLeaderboard:
         self.ties = ties
         self.winrate = calculate_winrate(wins, losses)
 
-    def with_win(self):
-        return PlayerStatsInLeaderboard(self.user_id, self.username, self.total_games + 1, self.wins + 1,
-                                        self.losses, self.ties)
 
-    def with_loss(self):
-        return PlayerStatsInLeaderboard(self.user_id, self.username, self.total_games + 1, self.wins,
-                                        self.losses + 1, self.ties)
-
-    def with_tie(self):
-        return PlayerStatsInLeaderboard(self.user_id, self.username, self.total_games + 1, self.wins,
-                                        self.losses, self.ties + 1)
+class MapStats:
+    def __init__(self, name: str, plays: int, team1_wins: int, team2_wins: int, ties: int, timed_games: int,
+                 duration_seconds: float):
+        self.name = name
+        self.plays = plays
+        self.team1_wins = team1_wins
+        self.team2_wins = team2_wins
+        self.ties = ties
+        self.decided_games = team1_wins + team2_wins
+        self.team1_winrate = team1_wins / self.decided_games if self.decided_games else None
+        self.average_duration_seconds = duration_seconds / timed_games if timed_games else None
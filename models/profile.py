@@ -12,10 +12,11 @@ def calculate_winrate(wins, losses) -> Optional[float]:
 
 class Profile:
     def __init__(self, user_id, username, position, last_played, hide_rank, games_played, bio, rank, confidence, wins,
-                 losses, ties):
+                 losses, ties, streak=0):
         self.wins = wins
         self.losses = losses
         self.ties = ties
+        self.streak = streak
         self.rank = rank
         self.confidence = confidence
         self.user_id = user_id
@@ -1,5 +1,6 @@
 from datetime import datetime
 from enum import Enum
+from typing import List
 
 MAX_QUEUE_SIZE = 10
 
@@ -63,3 +64,22 @@ class DelayQueueEntry:
         self.queue = queue
         self.target = target
         self.added = added
+
+
+class QueueStatus:
+    """
+    Point-in-time view of a queue: who is waiting and which of its games are live
+    """
+
+    def __init__(self, queue: Queue, usernames: List[str], live_games: list):
+        self.queue = queue
+        self.usernames = usernames
+        self.live_games = live_games
+
+    @property
+    def count(self) -> int:
+        return len(self.usernames)
+
+    @property
+    def is_live(self) -> bool:
+        return len(self.live_games) > 0
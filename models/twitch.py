@@ -1,48 +1,132 @@
-import requests
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from includes import metrics
+from includes.cache import TTLCache
+
+DEFAULT_AUTH_URL = "https://id.twitch.tv/oauth2"
+DEFAULT_API_URL = "https://api.twitch.tv/helix"
+# Refresh the app token this long before Twitch says it expires
+TOKEN_EXPIRY_MARGIN = 60
+# Helix returns at most 100 streams a page; pages beyond this are dropped so one poll stays a few requests
+MAX_PAGE_SIZE = 100
+MAX_PAGES = 5
+
+
+class TwitchError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"Twitch returned {status}: {message}")
+        self.status = status
+
 
 class TwitchStreams:
-    def __init__(self, client_id, client_secret, game_id):
+    """
+    Async Helix client for the streams of one game.
+    The app access token is kept until shortly before it expires and only replaced early when Twitch answers 401.
+    Stream results are cached for `streams_ttl` seconds; concurrent callers during a refresh share one fetch.
+    """
+
+    def __init__(self, client_id, client_secret, game_id, auth_url: str = DEFAULT_AUTH_URL,
+                 api_url: str = DEFAULT_API_URL, streams_ttl: float = 30, first: int = MAX_PAGE_SIZE):
         self.client_id = client_id
         self.client_secret = client_secret
         self.game_id = game_id
-        self.access_token = ""
-
-    def get_access_token(self):
-        url = f'https://id.twitch.tv/oauth2/token?client_id={self.client_id}&client_secret={self.client_secret}&grant_type=client_credentials'
-        response = requests.post(url)
-
-        if response.status_code == 200:
-            response_json = response.json()
-            self.access_token = response_json['access_token']
-            return response_json['access_token']
-        else:
-            response_json = response.json()
-            return None
-
-    def validate_access_token(self):
-        headers = {
-            'Content-type': 'application/json',
-            'Authorization': f'Bearer {self.access_token}',
-            'Client-Id': f'{self.client_id}',
-        }
-
-        url = f'https://id.twitch.tv/oauth2/validate'
-        response = requests.get(url, headers=headers)
-        return response.status_code == 200
-
-    def get_streams(self):
-        if not self.validate_access_token():
-            try:
-                self.access_token = self.get_access_token()
-            except Exception as error:
-                print(error)
-        print(self.access_token)
-        headers = {
-            'Content-type': 'application/json',
-            'Authorization': f'Bearer {self.access_token}',
-            'Client-Id': f'{self.client_id}',
-        }
-        url = f'https://api.twitch.tv/helix/streams?first=5&game_id={self.game_id}'
-        response = requests.get(url, headers=headers)
-        return response.json()
-        
+        self.auth_url = auth_url.rstrip("/")
+        self.api_url = api_url.rstrip("/")
+        self.first = first
+        self._access_token: Optional[str] = None
+        self._token_expires = 0.0
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._cache = TTLCache("twitch_streams", maxsize=1, ttl=streams_ttl)
+        # Created lazily, so they bind to the running loop rather than whichever loop existed at import
+        self._token_lock: Optional[asyncio.Lock] = None
+        self._streams_lock: Optional[asyncio.Lock] = None
+
+    async def get_streams(self) -> Dict:
+        streams = self._cache.get(self.game_id)
+        if streams is not None:
+            return streams
+
+        if self._streams_lock is None:
+            self._streams_lock = asyncio.Lock()
+        async with self._streams_lock:
+            # Whoever held the lock before us may have just refreshed it
+            if self.game_id in self._cache:
+                return self._cache.get(self.game_id)
+            streams = {"data": await self._get_all_streams()}
+            self._cache.set(self.game_id, streams)
+            return streams
+
+    async def _get_all_streams(self) -> List[Dict]:
+        """
+        :return: The game's live streams, most viewers first, following the pagination cursor up to MAX_PAGES pages
+        """
+        params = {"first": min(self.first, MAX_PAGE_SIZE), "game_id": self.game_id}
+        streams = []
+        for _ in range(MAX_PAGES):
+            page = await self._get("/streams", params)
+            streams += page.get('data', [])
+            cursor = page.get('pagination', {}).get('cursor')
+            if not cursor or not page.get('data'):
+                break
+            params = {**params, "after": cursor}
+        return streams
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _get(self, path: str, params: Dict) -> Dict:
+        for attempt in range(2):
+            token = await self._token()
+            async with self._http().get(f"{self.api_url}{path}", params=params, headers={
+                'Authorization': f'Bearer {token}',
+                'Client-Id': f'{self.client_id}',
+            }) as response:
+                metrics.inc("twitch_requests_total", endpoint=path, status=response.status)
+                if response.status == 401 and attempt == 0:
+                    # Revoked or expired early; fetch a new token and try once more
+                    self._invalidate_token(token)
+                    continue
+                if response.status != 200:
+                    raise TwitchError(response.status, await response.text())
+                return await response.json()
+
+    async def _token(self) -> str:
+        if self._token_valid():
+            return self._access_token
+
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        async with self._token_lock:
+            if self._token_valid():
+                return self._access_token
+            async with self._http().post(f"{self.auth_url}/token", params={
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'grant_type': 'client_credentials',
+            }) as response:
+                metrics.inc("twitch_requests_total", endpoint="/token", status=response.status)
+                if response.status != 200:
+                    raise TwitchError(response.status, await response.text())
+                body = await response.json()
+            self._access_token = body['access_token']
+            self._token_expires = time.monotonic() + body.get('expires_in', 0) - TOKEN_EXPIRY_MARGIN
+            return self._access_token
+
+    def _token_valid(self) -> bool:
+        return self._access_token is not None and time.monotonic() < self._token_expires
+
+    def _invalidate_token(self, token: str):
+        # Another request may already have replaced it
+        if self._access_token == token:
+            self._access_token = None
+
+    def _http(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        return self._session
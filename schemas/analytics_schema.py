@@ -0,0 +1,306 @@
+import calendar
+import datetime
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import pymongo
+from pymongo import UpdateOne
+
+from includes import mongo
+from models.game import GameStatus
+from models.profile import Outcome
+
+MIN_GAMES_FOR_WINRATE = 5
+
+# Finished games are summed into day and month buckets as they are recorded, so a leaderboard reads at most a few
+# dozen buckets per player instead of every PlayerData row in the period. Every rollup document has a `period`
+# (DAY or MONTH) and the `start` of that period.
+DAY = "day"
+MONTH = "month"
+ROLLUP_COLLECTIONS = ('PlayerRollups', 'GameRollups', 'MapRollups')
+# Computed leaderboards and map stats by period key ("all", "2022" or "2022-03", prefixed per report). A period only
+# changes when a game that ended in it is recorded or flipped, so entries stay valid until record_game / record_flip
+# drop them.
+ALL_TIME_KEY = "all"
+CACHED_REPORTS = ("leaderboard", "maps")
+_OUTCOME_FIELDS = {Outcome.WIN: "wins", Outcome.LOSS: "losses", Outcome.TIE: "ties"}
+# GameData.winningTeam: 1 or 2, 0 for a tie. Games finished before it was recorded don't have it.
+_WINNING_TEAM_FIELDS = {0: "ties", 1: "team1Wins", 2: "team2Wins"}
+
+
+def ensure_indexes():
+    mongo.db['GameData'].create_index([("status", pymongo.ASCENDING), ("ended", pymongo.ASCENDING)])
+    mongo.db['GameData'].create_index("started")
+    mongo.db['PlayerData'].create_index([("gameId", pymongo.ASCENDING)])
+    mongo.db['PlayerRollups'].create_index(
+        [("period", pymongo.ASCENDING), ("start", pymongo.ASCENDING), ("userId", pymongo.ASCENDING)], unique=True)
+    mongo.db['GameRollups'].create_index(
+        [("period", pymongo.ASCENDING), ("start", pymongo.ASCENDING)], unique=True)
+    mongo.db['MapRollups'].create_index(
+        [("period", pymongo.ASCENDING), ("start", pymongo.ASCENDING), ("map", pymongo.ASCENDING)], unique=True)
+
+
+def _period_starts(ended: datetime.datetime) -> Dict[str, datetime.datetime]:
+    return {DAY: datetime.datetime(ended.year, ended.month, ended.day),
+            MONTH: datetime.datetime(ended.year, ended.month, 1)}
+
+
+def _map_increments(game: dict) -> dict:
+    """
+    :return: MapRollups counters one finished GameData document adds to each of its maps
+    """
+    increments = {"count": 1}
+    if game.get('started') and game.get('ended'):
+        increments["timed"] = 1
+        increments["durationSeconds"] = (game['ended'] - game['started']).total_seconds()
+    if game.get('winningTeam') is not None:
+        increments[_WINNING_TEAM_FIELDS[game['winningTeam']]] = 1
+    return increments
+
+
+def record_game(game: dict, user_ids_to_outcome: Dict[int, Outcome]):
+    """
+    Adds a finished game to the day and month buckets it ended in
+    :param game: The game's GameData document
+    """
+    player_updates = []
+    map_updates = []
+    for period, start in _period_starts(game['ended']).items():
+        for user_id, outcome in user_ids_to_outcome.items():
+            player_updates.append(UpdateOne(
+                {"period": period, "start": start, "userId": user_id},
+                {"$inc": {"games": 1, _OUTCOME_FIELDS[outcome]: 1}}, upsert=True))
+        for _map in game.get('maps') or []:
+            map_updates.append(UpdateOne({"period": period, "start": start, "map": _map},
+                                         {"$inc": _map_increments(game)}, upsert=True))
+        mongo.db['GameRollups'].update_one({"period": period, "start": start}, {"$inc": {"games": 1}}, upsert=True)
+
+    if player_updates:
+        mongo.db['PlayerRollups'].bulk_write(player_updates, ordered=False)
+    if map_updates:
+        mongo.db['MapRollups'].bulk_write(map_updates, ordered=False)
+    invalidate_cached_leaderboards(game['ended'])
+
+
+def record_flip(game: dict, old_winner_ids: List[int], old_loser_ids: List[int]):
+    """
+    :param game: The game's GameData document, after its winning team was flipped
+    """
+    player_updates = []
+    map_updates = []
+    for period, start in _period_starts(game['ended']).items():
+        player_updates += [UpdateOne({"period": period, "start": start, "userId": user_id},
+                                     {"$inc": {"wins": -1, "losses": 1}}) for user_id in old_winner_ids]
+        player_updates += [UpdateOne({"period": period, "start": start, "userId": user_id},
+                                     {"$inc": {"wins": 1, "losses": -1}}) for user_id in old_loser_ids]
+        if game.get('winningTeam') in (1, 2):
+            new_field = _WINNING_TEAM_FIELDS[game['winningTeam']]
+            old_field = _WINNING_TEAM_FIELDS[3 - game['winningTeam']]
+            map_updates += [UpdateOne({"period": period, "start": start, "map": _map},
+                                      {"$inc": {old_field: -1, new_field: 1}}) for _map in game.get('maps') or []]
+    if player_updates:
+        mongo.db['PlayerRollups'].bulk_write(player_updates, ordered=False)
+    if map_updates:
+        mongo.db['MapRollups'].bulk_write(map_updates, ordered=False)
+    invalidate_cached_leaderboards(game['ended'])
+
+
+def rollups_exist() -> bool:
+    return mongo.db['GameRollups'].find_one({}) is not None
+
+
+def rebuild_rollups():
+    """
+    Recomputes every bucket from GameData and PlayerData
+    """
+    players = defaultdict(lambda: defaultdict(int))
+    games = defaultdict(int)
+    maps = defaultdict(lambda: defaultdict(int))
+
+    finished = mongo.db['GameData'].find({"status": GameStatus.FINISHED.value, "ended": {"$ne": None}},
+                                         {"gameId": 1, "started": 1, "ended": 1, "maps": 1, "winningTeam": 1})
+    starts_by_game_id = {}
+    for game in finished:
+        starts = _period_starts(game['ended'])
+        starts_by_game_id[game['gameId']] = starts
+        for period, start in starts.items():
+            games[(period, start)] += 1
+            for _map in game.get('maps') or []:
+                for field, amount in _map_increments(game).items():
+                    maps[(period, start, _map)][field] += amount
+
+    for result in mongo.db['PlayerData'].find({}, {"userId": 1, "gameId": 1, "outcome": 1}):
+        starts = starts_by_game_id.get(result['gameId'])
+        if starts is None:
+            continue
+        for period, start in starts.items():
+            counts = players[(period, start, result['userId'])]
+            counts["games"] += 1
+            counts[_OUTCOME_FIELDS[Outcome(result['outcome'])]] += 1
+
+    for collection in ROLLUP_COLLECTIONS:
+        mongo.db[collection].delete_many({})
+    _insert_all('PlayerRollups', [{"period": period, "start": start, "userId": user_id, **counts}
+                                  for (period, start, user_id), counts in players.items()])
+    _insert_all('GameRollups', [{"period": period, "start": start, "games": count}
+                                for (period, start), count in games.items()])
+    _insert_all('MapRollups', [{"period": period, "start": start, "map": _map, **counts}
+                               for (period, start, _map), counts in maps.items()])
+    # Only once the buckets are complete, so no report is cached from a partial set
+    mongo.db['LeaderboardCache'].delete_many({})
+
+
+def leaderboard_cache_key(year: Optional[int], month: Optional[int], report: str = "leaderboard") -> str:
+    if year is None:
+        period = ALL_TIME_KEY
+    else:
+        period = str(year) if month is None else f"{year}-{month:02d}"
+    return period if report == "leaderboard" else f"{report}:{period}"
+
+
+def get_cached_leaderboard(key: str) -> Optional[dict]:
+    return mongo.db['LeaderboardCache'].find_one({"_id": key})
+
+
+def save_cached_leaderboard(key: str, leaderboard: dict):
+    mongo.db['LeaderboardCache'].replace_one({"_id": key}, {**leaderboard, "_id": key,
+                                                            "computed": datetime.datetime.now()}, upsert=True)
+
+
+def invalidate_cached_leaderboards(ended: datetime.datetime):
+    """
+    Drops the cached reports of every period containing `ended`
+    """
+    keys = [leaderboard_cache_key(year, month, report) for report in CACHED_REPORTS
+            for year, month in ((None, None), (ended.year, None), (ended.year, ended.month))]
+    mongo.db['LeaderboardCache'].delete_many({"_id": {"$in": keys}})
+
+
+def _insert_all(collection: str, documents: List[dict]):
+    if documents:
+        mongo.db[collection].insert_many(documents, ordered=False)
+
+
+def _month_start(day: datetime.date) -> datetime.date:
+    return datetime.date(day.year, day.month, 1)
+
+
+def _next_month(day: datetime.date) -> datetime.date:
+    return datetime.date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def _to_datetime(day: datetime.date) -> datetime.datetime:
+    return datetime.datetime(day.year, day.month, day.day)
+
+
+def _bucket_match(start_date: Optional[datetime.date], end_date: Optional[datetime.date]) -> dict:
+    """
+    :return: Filter selecting the fewest buckets that exactly cover the inclusive date range: monthly buckets for
+    whole months, daily buckets for the partial months at either end. No dates means all time.
+    """
+    if start_date is None and end_date is None:
+        return {"period": MONTH}
+    start_date = start_date or datetime.date(datetime.MINYEAR, 1, 1)
+    end_date = end_date or datetime.date.today()
+
+    first_full_month = start_date if start_date.day == 1 else _next_month(start_date)
+    last_day = calendar.monthrange(end_date.year, end_date.month)[1]
+    after_last_full_month = _next_month(end_date) if end_date.day == last_day else _month_start(end_date)
+
+    if first_full_month >= after_last_full_month:
+        return {"period": DAY, "start": {"$gte": _to_datetime(start_date), "$lte": _to_datetime(end_date)}}
+
+    clauses = [{"period": MONTH,
+                "start": {"$gte": _to_datetime(first_full_month), "$lt": _to_datetime(after_last_full_month)}}]
+    if start_date < first_full_month:
+        clauses.append({"period": DAY,
+                        "start": {"$gte": _to_datetime(start_date), "$lt": _to_datetime(first_full_month)}})
+    if after_last_full_month <= end_date:
+        clauses.append({"period": DAY,
+                        "start": {"$gte": _to_datetime(after_last_full_month), "$lte": _to_datetime(end_date)}})
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+def _top(sort: dict, limit: int, match: dict = None) -> List[dict]:
+    """
+    Facet stages for one top-k list. Usernames are only looked up for the players that made the cut.
+    """
+    stages = [{"$match": match}] if match else []
+    return stages + [
+        {"$sort": {**sort, "_id": pymongo.ASCENDING}},
+        {"$limit": limit},
+        {"$lookup": {"from": "Profiles", "localField": "_id", "foreignField": "userId", "as": "profile"}},
+        {"$project": {"games": 1, "wins": 1, "losses": 1, "ties": 1, "winrate": 1,
+                      "username": {"$arrayElemAt": ["$profile.username", 0]}}},
+    ]
+
+
+def query_player_leaderboard(start_date: Optional[datetime.date], end_date: Optional[datetime.date],
+                             limit: int) -> dict:
+    """
+    :return: {"mostGames": [...], "mostWins": [...], "highestWinrate": [...], "anyWinrate": [...], "players": n}
+    where each list holds {"_id": userId, "username", "games", "wins", "losses", "ties", "winrate"}.
+    highestWinrate only includes players with at least MIN_GAMES_FOR_WINRATE games.
+    """
+    pipeline = [
+        {"$match": _bucket_match(start_date, end_date)},
+        {"$group": {
+            "_id": "$userId",
+            "games": {"$sum": "$games"},
+            "wins": {"$sum": "$wins"},
+            "losses": {"$sum": "$losses"},
+            "ties": {"$sum": "$ties"},
+        }},
+        {"$match": {"games": {"$gt": 0}}},
+        {"$addFields": {"winrate": {"$cond": [
+            {"$eq": [{"$add": ["$wins", "$losses"]}, 0]},
+            None,
+            {"$divide": ["$wins", {"$add": ["$wins", "$losses"]}]}
+        ]}}},
+        {"$facet": {
+            "mostGames": _top({"games": pymongo.DESCENDING}, limit),
+            "mostWins": _top({"wins": pymongo.DESCENDING}, limit),
+            "highestWinrate": _top({"winrate": pymongo.DESCENDING}, limit,
+                                   {"winrate": {"$ne": None}, "games": {"$gte": MIN_GAMES_FOR_WINRATE}}),
+            "anyWinrate": _top({"winrate": pymongo.DESCENDING}, limit, {"winrate": {"$ne": None}}),
+            "players": [{"$count": "count"}],
+        }},
+    ]
+    result = next(mongo.db['PlayerRollups'].aggregate(pipeline))
+    result["players"] = result["players"][0]["count"] if result["players"] else 0
+    return result
+
+
+def query_game_summary(start_date: Optional[datetime.date], end_date: Optional[datetime.date],
+                       num_maps: int) -> dict:
+    """
+    :return: {"games": n, "maps": [{"_id": map, "count": n}, ...]}
+    """
+    match = _bucket_match(start_date, end_date)
+    games = list(mongo.db['GameRollups'].aggregate([
+        {"$match": match},
+        {"$group": {"_id": None, "games": {"$sum": "$games"}}},
+    ]))
+    maps = list(mongo.db['MapRollups'].aggregate([
+        {"$match": match},
+        {"$group": {"_id": "$map", "count": {"$sum": "$count"}}},
+        {"$sort": {"count": pymongo.DESCENDING, "_id": pymongo.ASCENDING}},
+        {"$limit": num_maps},
+    ]))
+    return {"games": games[0]["games"] if games else 0, "maps": maps}
+
+
+def query_map_stats(start_date: Optional[datetime.date], end_date: Optional[datetime.date]) -> List[dict]:
+    """
+    :return: One document per map, most played first: {"_id": map, "count", "team1Wins", "team2Wins", "ties",
+    "timed", "durationSeconds"}
+    """
+    return list(mongo.db['MapRollups'].aggregate([
+        {"$match": _bucket_match(start_date, end_date)},
+        {"$group": {
+            "_id": "$map",
+            **{field: {"$sum": f"${field}"}
+               for field in ("count", "team1Wins", "team2Wins", "ties", "timed", "durationSeconds")}
+        }},
+        {"$sort": {"count": pymongo.DESCENDING, "_id": pymongo.ASCENDING}},
+    ]))
@@ -1,7 +1,7 @@
 import datetime
 from itertools import combinations
 import random
-from typing import List
+from typing import List, Dict, Optional, FrozenSet
 import hashlib
 import pymongo
 from discord import User
@@ -9,8 +9,10 @@ from pymongo import ASCENDING
 from trueskill import Rating, rate
 
 import config
-from includes import custom_ids
+from includes import custom_ids, metrics
 from includes import mongo
+from includes.loader import BatchLoader
+from schemas import member_schema
 from models.game import GameStatus, EmptyGame
 from models.queue_models import Queue
 
@@ -19,6 +21,23 @@ NUM_OFFENSE_NEEDED = config.variables['num_offense_needed']
 NUM_CHASE_NEEDED = config.variables['num_chase_needed']
 NUM_HOME_NEEDED = config.variables['num_home_needed']
 TEAM_SIZE = NUM_OFFENSE_NEEDED + NUM_CHASE_NEEDED + NUM_HOME_NEEDED
+LIVE_STATUSES = (GameStatus.PENDING.value, GameStatus.STARTED.value)
+
+# Live games are read on every button click, so their GameData documents and Ingame rosters are kept in memory.
+# Every write to GameData and Ingame goes through this module and updates the registry after the write;
+# load_live_games rebuilds it from Mongo at startup.
+_live_games: Dict[str, dict] = {}
+_rosters: Dict[str, Dict[int, dict]] = {}
+_game_ids_by_user: Dict[int, str] = {}
+# Players of the most recently finished game, for re-add checks
+_last_finished_game_id: Optional[str] = None
+_last_finished_roster: FrozenSet[int] = frozenset()
+
+
+@metrics.collector
+def _live_game_gauges():
+    metrics.set_gauge("live_games", len(_live_games))
+    metrics.set_gauge("ingame_players", len(_game_ids_by_user))
 
 
 class Player:
@@ -52,14 +71,60 @@ def create_game(queue: Queue, game_id, maps):
     }
 
     mongo.db['GameData'].insert_one(data)
+    _live_games[game_id] = data
+    _rosters[game_id] = {}
+
+
+def load_live_games():
+    _live_games.clear()
+    _rosters.clear()
+    _game_ids_by_user.clear()
+    for game in mongo.db['GameData'].find({"status": {"$in": LIVE_STATUSES}}):
+        _live_games[game['gameId']] = game
+        _rosters[game['gameId']] = {}
+    for player in mongo.db['Ingame'].find({"gameId": {"$in": list(_live_games)}}):
+        _index_player(player)
+    _load_last_finished()
+
+
+def _load_last_finished():
+    global _last_finished_game_id, _last_finished_roster
+    game = mongo.db['GameData'].find_one({"status": GameStatus.FINISHED.value}, sort=[("ended", pymongo.DESCENDING)])
+    _last_finished_game_id = game['gameId'] if game else None
+    _last_finished_roster = frozenset(
+        member_schema.query_user_ids_who_have_played_in_games([game['gameId']]) if game else [])
+
+
+def _index_player(player):
+    _rosters.setdefault(player['gameId'], {})[player['userId']] = player
+    _game_ids_by_user[player['userId']] = player['gameId']
+    roster_loader.forget(player['gameId'])
+
+
+def _clear_roster(game_id):
+    for user_id in _rosters.get(game_id, {}):
+        if _game_ids_by_user.get(user_id) == game_id:
+            del _game_ids_by_user[user_id]
+    _rosters[game_id] = {}
+    roster_loader.forget(game_id)
+
+
+def _forget_game(game_id):
+    _clear_roster(game_id)
+    _rosters.pop(game_id, None)
+    _live_games.pop(game_id, None)
 
 
 def generate_teams(queue: Queue, game_id):
+    user_ids = [player['userId'] for player in mongo.db['Queue'].find({"queue": queue.value}).limit(10)]
+    mongo.db['Queue'].delete_many({"userId": {"$in": user_ids}})
+    profiles = member_schema.get_profiles_by_ids(user_ids)
+    ranks = member_schema.get_ranks_by_ids(user_ids)
+
     players = []
-    for player in mongo.db['Queue'].find({"queue": queue.value}).limit(10):
-        mongo.db['Queue'].delete_many({"userId": player['userId']})
-        player_profile = mongo.db['Profiles'].find_one({"userId": player['userId']})
-        player_rank = mongo.db['Ranks'].find_one({"userId": player['userId']})
+    for user_id in user_ids:
+        player_profile = profiles[user_id]
+        player_rank = ranks[user_id]
 
         players.append(Player(player_rank['userId'], player_rank['username'],
                               Rating(player_rank['rank'], player_rank['confidence']), player_profile['position']))
@@ -109,7 +174,7 @@ def hash_team_combination(team):
 
 def generate_match_combinations(players: List[Player], game_id, reshuffle_count: int = 0):
     required_positions = {'offense': NUM_OFFENSE_NEEDED, 'chase': NUM_CHASE_NEEDED, 'home': NUM_HOME_NEEDED}
-    game_data = mongo.db['GameData'].find_one({"gameId": game_id})
+    game_data = get_game(game_id)
     previous_hashes = set(game_data.get("previous_team_hashes", []))
     players.sort(key=lambda player: player.rating.mu, reverse=True)
     all_matches = []
@@ -141,31 +206,29 @@ def set_teams_for_game(game_id, players, reshuffles):
         mongo.db["GameData"].update_one(
             {"gameId": game_id},
             {"$set": {"reshuffles": reshuffles},
-             "$push": {"previous_team_hashes": [team1_hash, team2_hash]}}
+             "$push": {"previous_team_hashes": {"$each": [team1_hash, team2_hash]}}}
         )
+        game = _live_games.get(game_id)
+        if game is not None:
+            game['reshuffles'] = reshuffles
+            game['previous_team_hashes'] = game.get('previous_team_hashes', []) + [team1_hash, team2_hash]
 
         team1_captain = next((player for player in team1 if player.is_captain), random.choice(team1))
         team2_captain = next((player for player in team2 if player.is_captain), random.choice(team2))
 
-        for player in team1:
-            data = {
-                "userId": player.user_id,
-                "username": player.username,
-                "team": 1,
-                "isCaptain": player.user_id == team1_captain.user_id,
-                "gameId": game_id
-            }
-            mongo.db['Ingame'].insert_one(data)
-
-        for player in team2:
-            data = {
-                "userId": player.user_id,
-                "username": player.username,
-                "team": 2,
-                "isCaptain": player.user_id == team2_captain.user_id,
-                "gameId": game_id
-            }
-            mongo.db['Ingame'].insert_one(data)
+        ingame_players = []
+        for team, players, captain in ((1, team1, team1_captain), (2, team2, team2_captain)):
+            for player in players:
+                ingame_players.append({
+                    "userId": player.user_id,
+                    "username": player.username,
+                    "team": team,
+                    "isCaptain": player.user_id == captain.user_id,
+                    "gameId": game_id
+                })
+        mongo.db['Ingame'].insert_many(ingame_players)
+        for player in ingame_players:
+            _index_player(player)
     else:
         print("No unique team combinations available for reshuffling.")
 
@@ -177,18 +240,23 @@ def shuffle_teams(game_id):
     current_captains = get_captains(game_id)
     captain_ids = {captain['userId'] for captain in current_captains}
 
+    user_ids = [player_data['userId'] for player_data in get_all_ingame_players(game_id)]
+    profiles = member_schema.get_profiles_by_ids(user_ids)
+    ranks = member_schema.get_ranks_by_ids(user_ids)
+
     players = []
-    for player_data in game["players"]:
-        player_profile = mongo.db['Profiles'].find_one({"userId": player_data['userId']})
-        player_rank = mongo.db['Ranks'].find_one({"userId": player_data['userId']})
+    for user_id in user_ids:
+        player_profile = profiles[user_id]
+        player_rank = ranks[user_id]
 
-        captain_status = player_data['userId'] in captain_ids
+        captain_status = user_id in captain_ids
 
         players.append(Player(player_rank['userId'], player_rank['username'],
                               Rating(player_rank['rank'], player_rank['confidence']),
                               player_profile['position'], captain_status=captain_status))
 
     mongo.db['Ingame'].delete_many({"gameId": game_id})
+    _clear_roster(game_id)
     set_teams_for_game(game_id, players, reshuffles)
 
 
@@ -202,146 +270,127 @@ def update_game_status(game_id, status):
         }
     }
     mongo.db['GameData'].update_one(status_query, data)
+    if game_id in _live_games:
+        if status in LIVE_STATUSES:
+            _live_games[game_id]['status'] = status
+        else:
+            _forget_game(game_id)
 
 
 def get_captains(game_id):
-    return list(mongo.db['Ingame'].find({"gameId": game_id, "isCaptain": True}).sort("team"))
+    return sorted([player for player in get_all_ingame_players(game_id) if player['isCaptain']],
+                  key=lambda player: player['team'])
 
 
 def get_team(game_id, team: int):
-    return mongo.db['Ingame'].find({"gameId": game_id, "team": team})
+    return [player for player in get_all_ingame_players(game_id) if player['team'] == team]
 
 
 def get_all_ingame_players(game_id):
-    return mongo.db['Ingame'].find({"gameId": game_id})
+    if game_id in _live_games:
+        return list(_rosters.get(game_id, {}).values())
+    return list(mongo.db['Ingame'].find({"gameId": game_id}))
+
+
+def get_rosters_by_game_ids(game_ids) -> Dict[str, List[dict]]:
+    """
+    :return: gameId -> Ingame documents. Live games are served from memory, the rest with one query.
+    """
+    rosters = {game_id: list(_rosters.get(game_id, {}).values()) for game_id in game_ids if game_id in _live_games}
+    missing = [game_id for game_id in game_ids if game_id not in _live_games]
+    if missing:
+        for player in mongo.db['Ingame'].find({"gameId": {"$in": missing}}):
+            rosters.setdefault(player['gameId'], []).append(player)
+    return rosters
+
+
+# Looked up at call time, like member_schema's loaders, so instrumentation wrapping the module applies
+roster_loader = BatchLoader("rosters", lambda game_ids: get_rosters_by_game_ids(game_ids))
 
 
 def is_games(queue):
-    if queue is None:
-        data = {
-            "$or": [
-                {
-                    "status": 1
-                },
-                {
-                    "status": 2
-                }
-            ]
-        }
-        if mongo.db['GameData'].count_documents(data) > 0:
-            return True
-        else:
-            return False
-    else:
-        data = {
-            "queue": queue,
-            "$or": [
-                {
-                    "status": 1
-                },
-                {
-                    "status": 2
-                }
-            ]
-        }
-        if mongo.db['GameData'].count_documents(data) > 0:
-            return True
-        else:
-            return False
+    """
+    :param queue: Queue name, or None for any queue
+    """
+    return any(queue is None or game['queue'] == queue for game in _live_games.values())
 
 
 def get_games(queue: Queue):
-    if queue is None:
-        data = {
-            "$or": [
-                {
-                    "status": 1
-                },
-                {
-                    "status": 2
-                }
-            ]
-        }
-        return mongo.db['GameData'].find(data)
-    else:
-        data = {
-            "queue": queue.value,
-            "$or": [
-                {
-                    "status": 1
-                },
-                {
-                    "status": 2
-                }
-            ]
-        }
-        return mongo.db['GameData'].find(data)
+    return [game for game in _live_games.values() if queue is None or game['queue'] == queue.value]
 
 
 def get_game_id_from_user(user):
-    return mongo.db['Ingame'].find_one({"userId": user.id})['gameId']
+    return _game_ids_by_user[user.id]
 
 
 def is_ingame(user):
-    result = mongo.db['Ingame'].find_one({"userId": user.id})
-
-    if result:
-        return True
-    else:
-        return False
+    return user.id in _game_ids_by_user
 
 
 def is_captain(user):
-    if mongo.db['Ingame'].find_one({"userId": user.id, "isCaptain": True}):
-        return True
-    else:
-        return False
+    game_id = _game_ids_by_user.get(user.id)
+    return game_id is not None and new_is_captain(game_id, user)
 
 
 def new_is_captain(game_id, user):
-    if mongo.db['Ingame'].find_one({"gameId": game_id, "userId": user.id, "isCaptain": True}):
-        return True
-    else:
-        return False
+    player = _rosters.get(game_id, {}).get(user.id)
+    return player is not None and player['isCaptain']
+
 
+def was_in_last_finished_game(user_id) -> bool:
+    return user_id in _last_finished_roster
 
-def update_rankings(winner_ids: List[int], loser_ids: List[int], tie: bool):
-    winning_team_ranks = {}
-    for rank in mongo.db["Ranks"].find({"userId": {"$in": [user_id for user_id in winner_ids]}}):
-        winning_team_ranks[rank["userId"]] = Rating(rank["rank"], rank["confidence"])
 
-    losing_team_ranks = {}
-    for rank in mongo.db["Ranks"].find({"userId": {"$in": [user_id for user_id in loser_ids]}}):
-        losing_team_ranks[rank["userId"]] = Rating(rank["rank"], rank["confidence"])
+def update_rankings(winner_ids: List[int], loser_ids: List[int], tie: bool) -> Dict[int, Rating]:
+    """
+    :return: userId -> new rating
+    """
+    ranks = member_schema.get_ranks_by_ids(winner_ids + loser_ids)
+    winning_team_ranks = {user_id: Rating(ranks[user_id]["rank"], ranks[user_id]["confidence"])
+                          for user_id in winner_ids if user_id in ranks}
+    losing_team_ranks = {user_id: Rating(ranks[user_id]["rank"], ranks[user_id]["confidence"])
+                         for user_id in loser_ids if user_id in ranks}
 
     game_outcome = [0, 0] if tie else [0, 1]
 
     new_winning_team_ranks, new_losing_team_ranks = rate([winning_team_ranks, losing_team_ranks], ranks=game_outcome)
     updated_ranks = {**new_winning_team_ranks, **new_losing_team_ranks}
-    for user_id in updated_ranks.keys():
-        true_skill = updated_ranks[user_id]
-        data = {
-            "$set": {
-                "rank": true_skill.mu,
-                "confidence": true_skill.sigma
-            }
-        }
-        mongo.db['Ranks'].update_one({"userId": user_id}, data)
+    member_schema.update_ranks(updated_ranks)
+    return updated_ranks
 
 
-def finish_game(game_id):
+def finish_game(game_id, winning_team: int):
+    """
+    :param winning_team: 1 or 2, 0 for a tie
+    """
+    global _last_finished_game_id, _last_finished_roster
     mongo.db['Ingame'].delete_many({"gameId": game_id})
     mongo.db['GameData'].update_one({"gameId": game_id}, {
         "$set": {
             "status": GameStatus.FINISHED.value,
-            "ended": datetime.datetime.now()
+            "ended": datetime.datetime.now(),
+            "winningTeam": winning_team
         }
     })
+    _last_finished_game_id = game_id
+    _last_finished_roster = frozenset(_rosters.get(game_id, {}))
+    _forget_game(game_id)
+
+
+def flip_winning_team(game_id):
+    """
+    :return: The game's GameData document after the flip
+    """
+    return mongo.db['GameData'].find_one_and_update(
+        {"gameId": game_id, "winningTeam": {"$in": [1, 2]}},
+        [{"$set": {"winningTeam": {"$subtract": [3, "$winningTeam"]}}}],
+        return_document=pymongo.ReturnDocument.AFTER) or get_game(game_id)
 
 
 def swap_players(user: User, target: User, game_id):
-    user_data = mongo.db["Ingame"].find_one({"userId": user.id, "gameId": game_id})
-    target_data = mongo.db["Ingame"].find_one({"userId": target.id, "gameId": game_id})
+    roster = _rosters[game_id]
+    user_data = roster[user.id]
+    target_data = roster[target.id]
 
     mongo.db["Ingame"].update_one({"_id": user_data["_id"]}, {
         "$set": {
@@ -357,36 +406,50 @@ def swap_players(user: User, target: User, game_id):
         }
     })
 
+    user_data.update({"userId": target.id, "username": target.display_name})
+    target_data.update({"userId": user.id, "username": user.display_name})
+    roster[user.id], roster[target.id] = target_data, user_data
+
 
 def sub_player(user, member):
     mongo.db['Ingame'].update_one({"userId": member.id}, {"$set": {"userId": user.id, "username": user.name}})
     mongo.db['Queue'].delete_many({"userId": user.id})
 
+    game_id = _game_ids_by_user.pop(member.id, None)
+    if game_id is not None:
+        player = _rosters[game_id].pop(member.id)
+        player.update({"userId": user.id, "username": user.name})
+        _index_player(player)
+
 
 def get_game(game_id):
+    if game_id in _live_games:
+        return _live_games[game_id]
     return mongo.db['GameData'].find_one({"gameId": game_id})
 
 
+def _set_live_game_fields(game_id, fields):
+    mongo.db['GameData'].update_one({"gameId": game_id}, {"$set": fields})
+    if game_id in _live_games:
+        _live_games[game_id].update(fields)
+
+
 def query(start_date: datetime.date, end_date: datetime.date):
     start_normalized = datetime.datetime(datetime.MINYEAR, 1, 1) if start_date is None else datetime.datetime(
         start_date.year, start_date.month, start_date.day)
     end_normalized = datetime.datetime(datetime.MAXYEAR, 1, 1) if end_date is None else datetime.datetime(
         end_date.year, end_date.month, end_date.day, 23, 59, 59)
-    return mongo.db['GameData'].find({
+    return list(mongo.db['GameData'].find({
         "ended": {
             "$gte": start_normalized,
             "$lte": end_normalized
         },
         "status": GameStatus.FINISHED.value
-    })
+    }))
 
 
 def update_maps(game_id, maps):
-    mongo.db['GameData'].update_one({"gameId": game_id}, {
-        "$set": {
-            "maps": maps
-        }
-    })
+    _set_live_game_fields(game_id, {"maps": maps})
 
 
 def get_games_last_24_hours():
@@ -396,11 +459,11 @@ def get_games_last_24_hours():
             "$gt": datetime.datetime.today() - datetime.timedelta(days=1)
         }
     }
-    return mongo.db['GameData'].find(data).sort("started", ASCENDING)
+    return list(mongo.db['GameData'].find(data).sort("started", ASCENDING))
 
 
 def new_map(game_id, maps, button_id):
-    game = mongo.db['GameData'].find_one({"gameId": game_id})
+    game = get_game(game_id)
     new_maps = []
 
     if game['queue'] == "quickplay":
@@ -408,29 +471,33 @@ def new_map(game_id, maps, button_id):
             new_maps = [maps[0], game['maps'][1]]
         elif button_id == custom_ids.shuffle_map_2:
             new_maps = [game['maps'][0], maps[0]]
-        mongo.db['GameData'].update_one({"gameId": game_id}, {"$set": {"maps": new_maps}})
+        _set_live_game_fields(game_id, {"maps": new_maps})
 
     return new_maps
 
 
 def choose_different_map(game_id, _map):
     maps = [_map]
-    mongo.db['GameData'].update_one({"gameId": game_id}, {"$set": {"maps": maps}})
+    _set_live_game_fields(game_id, {"maps": maps})
 
 
 def cancel_game(member):
     game_id = get_game_id_from_user(member)
-    mongo.db['GameData'].delete_one({"gameId": game_id})
-    mongo.db['Ingame'].delete_many({"gameId": game_id})
+    delete(game_id)
 
 
 def delete(game_id):
     mongo.db['GameData'].delete_one({"gameId": game_id})
     mongo.db['Ingame'].delete_many({"gameId": game_id})
+    _forget_game(game_id)
+    if game_id == _last_finished_game_id:
+        _load_last_finished()
 
 
 def override_timestamps(game_id, timestamp: datetime):
-    mongo.db['GameData'].update_one({"gameId": game_id}, {"$set": {"started": timestamp, "ended": timestamp}})
+    _set_live_game_fields(game_id, {"started": timestamp, "ended": timestamp})
+    # Moving a game's end time can change which game finished last
+    _load_last_finished()
 
 
 def raw_member_inqueue(member):
@@ -450,9 +517,17 @@ def get_recent_games(num_games) -> List[EmptyGame]:
                       GameStatus(game['status']), game.get('maps')) for game in data]
 
 
+def get_recently_started_games(num_games) -> List[dict]:
+    """
+    :return: gameId and maps of the last games started, live ones included, newest first
+    """
+    return list(mongo.db['GameData'].find({}, {"gameId": 1, "maps": 1})
+                .sort("started", pymongo.DESCENDING).limit(num_games))
+
+
 def update_game_suggested_server(game_id, server):
-    mongo.db['GameData'].update_one({"gameId": game_id}, {"$set": {"server": server}})
+    _set_live_game_fields(game_id, {"server": server})
 
 
 def get_game_server(game_id):
-    return mongo.db['GameData'].find_one({"gameId": game_id})['server']
+    return get_game(game_id)['server']
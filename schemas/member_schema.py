@@ -1,13 +1,40 @@
+import time
 from datetime import datetime
-from typing import Tuple, Dict, List
+from typing import Tuple, Dict, List, Set, Optional
 
 from discord import User
-from pymongo import UpdateOne
+from pymongo import UpdateOne, UpdateMany, ReturnDocument
 from trueskill import Rating
 
 from includes import mongo
+from includes.cache import TTLCache
+from includes.loader import BatchLoader
 from models.profile import Outcome, PlayerGameResult
 
+# Profiles and Ranks are read on nearly every command. Writes made through this module update the cached documents;
+# the TTL bounds how stale a document can get when it is changed by another replica.
+PROFILE_CACHE_SIZE = 5000
+PROFILE_CACHE_SECONDS = 300
+_profiles = TTLCache("profiles", PROFILE_CACHE_SIZE, PROFILE_CACHE_SECONDS)
+_ranks = TTLCache("ranks", PROFILE_CACHE_SIZE, PROFILE_CACHE_SECONDS)
+
+# Win/loss/tie counters and the current streak (positive for wins, negative for losses) are kept on each profile and
+# updated with every result write, so a profile view doesn't count PlayerData. rebuild_player_stats repairs them.
+STAT_FIELDS = {Outcome.WIN: "wins", Outcome.LOSS: "losses", Outcome.TIE: "ties"}
+
+# Ban checks run before every command, so banned ids are kept in memory. Ban writes bump a version stamp in Meta;
+# the stamp is re-read at most every BAN_SYNC_SECONDS so bans issued by other replicas are picked up.
+BAN_SYNC_SECONDS = 10
+_banned_ids: Set[int] = set()
+_banned_version = 0
+_banned_synced_at: Optional[float] = None
+
+
+def ensure_indexes():
+    mongo.db['Profiles'].create_index("userId")
+    mongo.db['Ranks'].create_index("userId")
+    mongo.db['PlayerData'].create_index("userId")
+
 
 def check_profile(user: User):
     rating = Rating()
@@ -22,58 +49,173 @@ def check_profile(user: User):
             "lastPlayed": "Never",
             "hideRank": True,
             "region": "Not Set",
-            "delayTarget": datetime.min
+            "delayTarget": datetime.min,
+            "wins": 0,
+            "losses": 0,
+            "ties": 0,
+            "streak": 0
         }
-        mongo.db['Profiles'].insert_one(data)
+        profile = mongo.db['Profiles'].find_one_and_update(
+            {"userId": user.id}, {"$setOnInsert": data}, upsert=True, return_document=ReturnDocument.AFTER)
+        _profiles.set(user.id, profile)
+    if rank is None:
         data = {
             "userId": user.id,
             "username": user.name,
             "rank": rating.mu,
             "confidence": rating.sigma
         }
-        mongo.db['Ranks'].insert_one(data)
-        return
+        rank = mongo.db['Ranks'].find_one_and_update(
+            {"userId": user.id}, {"$setOnInsert": data}, upsert=True, return_document=ReturnDocument.AFTER)
+        _ranks.set(user.id, rank)
     if user.name != profile['username']:
-        mongo.db['Profiles'].update_one(
-            {"userId": user.id},
-            {"$set": {"username": user.name}})
+        _update_profile(user.id, {"username": user.name})
     if user.name != rank['username']:
         mongo.db['Ranks'].update_one(
             {"userId": user.id},
             {"$set": {"username": user.name}})
+        rank['username'] = user.name
+
+
+def _find_cached(cache: TTLCache, collection: str, user_id):
+    document = cache.get(user_id)
+    if document is None:
+        document = mongo.db[collection].find_one({"userId": user_id})
+        if document is not None:
+            cache.set(user_id, document)
+    return document
+
+
+def _find_many_cached(cache: TTLCache, collection: str, user_ids) -> Dict[int, dict]:
+    documents = {}
+    missing = []
+    for user_id in user_ids:
+        document = cache.get(user_id)
+        if document is None:
+            missing.append(user_id)
+        else:
+            documents[user_id] = document
+    if missing:
+        for document in mongo.db[collection].find({"userId": {"$in": missing}}):
+            cache.set(document['userId'], document)
+            documents[document['userId']] = document
+    return documents
+
+
+def _update_profile(user_id, fields: dict):
+    mongo.db['Profiles'].update_one({"userId": user_id}, {"$set": fields})
+    cached = _profiles.get(user_id)
+    if cached is not None:
+        cached.update(fields)
+    else:
+        profile_loader.forget(user_id)
 
 
 def get_profile(user):
-    return mongo.db['Profiles'].find_one({"userId": user.id})
+    return _find_cached(_profiles, 'Profiles', user.id)
 
 
 def get_player_region(user_id):
-    return mongo.db['Profiles'].find_one({"userId": user_id})['region']
+    return profile_loader.load(user_id)['region']
 
 
 def get_profile_by_id(user_id):
-    return mongo.db['Profiles'].find_one({"userId": user_id})
+    return profile_loader.load(user_id)
+
+
+def get_profiles_by_ids(user_ids) -> Dict[int, dict]:
+    """
+    :return: userId -> profile, served from the cache with one query for any misses
+    """
+    return _find_many_cached(_profiles, 'Profiles', user_ids)
+
+
+def get_ranks_by_ids(user_ids) -> Dict[int, dict]:
+    return _find_many_cached(_ranks, 'Ranks', user_ids)
+
+
+# Per-request batching on top of the caches: prefetch the ids a loop will need, then load them one at a time.
+# The batch functions are looked up at call time so they go through any wrapper installed on the module later.
+profile_loader = BatchLoader("profiles", lambda user_ids: get_profiles_by_ids(user_ids))
+rank_loader = BatchLoader("ranks", lambda user_ids: get_ranks_by_ids(user_ids))
+
+
+def get_rated_ranks():
+    """
+    :return: Ranks of every player whose rating has moved from the default, i.e. who has played
+    """
+    return list(mongo.db['Ranks'].find({"confidence": {"$lt": Rating().sigma}},
+                                       {"_id": 0, "userId": 1, "rank": 1, "confidence": 1}))
+
+
+def update_ranks(ratings: Dict[int, Rating]):
+    mongo.db['Ranks'].bulk_write([
+        UpdateOne({"userId": user_id}, {"$set": {"rank": rating.mu, "confidence": rating.sigma}})
+        for user_id, rating in ratings.items()
+    ])
+    for user_id, rating in ratings.items():
+        cached = _ranks.get(user_id)
+        if cached is not None:
+            cached.update({"rank": rating.mu, "confidence": rating.sigma})
+        else:
+            rank_loader.forget(user_id)
 
 
 def query_user_ids_who_have_played_in_games(game_ids) -> List[int]:
     return mongo.db['PlayerData'].distinct("userId", {"gameId": {"$in": game_ids}})
 
 
-def is_banned(user):
-    if mongo.db['Banned'].count_documents({"userId": user.id}) > 0:
-        return True
+def load_banned():
+    global _banned_ids, _banned_version, _banned_synced_at
+    stamp = mongo.db['Meta'].find_one({"_id": "banned"})
+    _banned_version = stamp['version'] if stamp else 0
+    _banned_ids = set(mongo.db['Banned'].distinct("userId"))
+    _banned_synced_at = time.monotonic()
+
+
+def _sync_banned():
+    global _banned_synced_at
+    if _banned_synced_at is None:
+        load_banned()
+        return
+    if time.monotonic() - _banned_synced_at < BAN_SYNC_SECONDS:
+        return
+
+    stamp = mongo.db['Meta'].find_one({"_id": "banned"})
+    if (stamp['version'] if stamp else 0) != _banned_version:
+        load_banned()
+    else:
+        _banned_synced_at = time.monotonic()
+
+
+def _bump_banned_version():
+    global _banned_version
+    stamp = mongo.db['Meta'].find_one_and_update({"_id": "banned"}, {"$inc": {"version": 1}}, upsert=True,
+                                                 return_document=ReturnDocument.AFTER)
+    if stamp['version'] != _banned_version + 1:
+        # Another replica changed bans since our last sync
+        load_banned()
     else:
-        return False
+        _banned_version = stamp['version']
+
+
+def is_banned(user):
+    _sync_banned()
+    return user.id in _banned_ids
 
 
 def ban_player(admin, member):
     mongo.db['Banned'].insert_one(
         {"userId": member.id, "username": member.name, "issued": datetime.now(), "by": admin.name})
     mongo.db['Warnings'].delete_many({"userId": member.id})
+    _banned_ids.add(member.id)
+    _bump_banned_version()
 
 
 def unban_player(member):
     mongo.db['Banned'].delete_one({"userId": member.id})
+    _banned_ids.discard(member.id)
+    _bump_banned_version()
 
 
 def get_top_players():
@@ -91,48 +233,71 @@ def get_total_games():
 
 def update_player_position(user, position):
     if position == "offense":
-        mongo.db['Profiles'].update_one({"userId": user.id}, {"$set": {"position": "Offense"}})
+        _update_profile(user.id, {"position": "Offense"})
     elif position == "homed":
-        mongo.db['Profiles'].update_one({"userId": user.id}, {"$set": {"position": "Home D"}})
+        _update_profile(user.id, {"position": "Home D"})
     elif position == "chase":
-        mongo.db['Profiles'].update_one({"userId": user.id}, {"$set": {"position": "Chase"}})
+        _update_profile(user.id, {"position": "Chase"})
     elif position == "flexible":
-        mongo.db['Profiles'].update_one({"userId": user.id}, {"$set": {"position": "Flexible"}})
+        _update_profile(user.id, {"position": "Flexible"})
 
 
 def get_player_rank(user):
-    return mongo.db['Ranks'].find_one({"userId": user.id})
+    return _find_cached(_ranks, 'Ranks', user.id)
 
 
 def get_player_rank_by_id(user_id):
-    return mongo.db['Ranks'].find_one({"userId": user_id})
+    return _find_cached(_ranks, 'Ranks', user_id)
 
 
 def change_rank_visibility(user, option: bool):
-    data = {
-        "$set": {
-            "hideRank": option
-        }
-    }
-
     print(option)
     try:
-        mongo.db['Profiles'].update_one({"userId": user.id}, data)
+        _update_profile(user.id, {"hideRank": option})
     except Exception as e:
         print(e)
 
 
 def update_profile_bio(user, bio):
-    mongo.db['Profiles'].update_one({"userId": user.id}, {"$set": {"bio": bio}})
+    _update_profile(user.id, {"bio": bio})
+
+
+def _counter(field: str) -> dict:
+    return {"$ifNull": [f"${field}", 0]}
+
+
+def _result_update(outcome: Outcome, now: datetime) -> List[dict]:
+    """
+    :return: Update pipeline applying one game result to a profile in a single atomic write
+    """
+    streak = _counter("streak")
+    if outcome == Outcome.WIN:
+        new_streak = {"$cond": [{"$gt": [streak, 0]}, {"$add": [streak, 1]}, 1]}
+    elif outcome == Outcome.LOSS:
+        new_streak = {"$cond": [{"$lt": [streak, 0]}, {"$subtract": [streak, 1]}, -1]}
+    else:
+        new_streak = 0
+    field = STAT_FIELDS[outcome]
+    return [{"$set": {
+        "gamesPlayed": {"$add": [_counter("gamesPlayed"), 1]},
+        "lastPlayed": now,
+        field: {"$add": [_counter(field), 1]},
+        "streak": new_streak
+    }}]
 
 
 def finish_game_for_users(game_id, user_ids_to_outcome: Dict[int, Outcome]):
-    mongo.db['Profiles'].update_many(
-        {"userId": {"$in": (list(user_ids_to_outcome.keys()))}},
-        {
-            "$inc": {"gamesPlayed": 1},
-            "$set": {"lastPlayed": datetime.now()}
-        })
+    now = datetime.now()
+    user_ids_by_outcome = {}
+    for user_id, outcome in user_ids_to_outcome.items():
+        user_ids_by_outcome.setdefault(outcome, []).append(user_id)
+    mongo.db['Profiles'].bulk_write([
+        UpdateMany({"userId": {"$in": user_ids}}, _result_update(outcome, now))
+        for outcome, user_ids in user_ids_by_outcome.items()
+    ])
+    for user_id in user_ids_to_outcome.keys():
+        _profiles.pop(user_id)
+        profile_loader.forget(user_id)
     mongo.db["PlayerData"].insert_many(
         {
             "userId": user_id,
@@ -142,12 +307,24 @@ def finish_game_for_users(game_id, user_ids_to_outcome: Dict[int, Outcome]):
 
 
 def set_delay_targets(delay_targets: Dict[int, datetime]):
+    if not delay_targets:
+        return
     mongo.db['Profiles'].bulk_write(
         [UpdateOne({"userId": user_id}, {"$set": {"delayTarget": target}}) for user_id, target in delay_targets.items()]
     )
+    for user_id, target in delay_targets.items():
+        cached = _profiles.get(user_id)
+        if cached is not None:
+            cached['delayTarget'] = target
 
 
 def update_outcome_for_users(game_id, user_ids, outcome: Outcome):
+    previous = mongo.db["PlayerData"].find(
+        {"userId": {"$in": user_ids}, "gameId": game_id, "outcome": {"$ne": outcome.value}}, {"userId": 1, "outcome": 1})
+    changed_user_ids_by_outcome = {}
+    for result in previous:
+        changed_user_ids_by_outcome.setdefault(Outcome(result["outcome"]), []).append(result["userId"])
+
     mongo.db["PlayerData"].update_many(
         {
             "userId": {"$in": user_ids},
@@ -159,16 +336,98 @@ def update_outcome_for_users(game_id, user_ids, outcome: Outcome):
             }
         })
 
+    if changed_user_ids_by_outcome:
+        mongo.db['Profiles'].bulk_write([
+            UpdateMany({"userId": {"$in": changed_user_ids}},
+                       {"$inc": {STAT_FIELDS[previous_outcome]: -1, STAT_FIELDS[outcome]: 1}})
+            for previous_outcome, changed_user_ids in changed_user_ids_by_outcome.items()
+        ])
+        changed_user_ids = [user_id for ids in changed_user_ids_by_outcome.values() for user_id in ids]
+        for user_id in changed_user_ids:
+            _profiles.pop(user_id)
+            profile_loader.forget(user_id)
+        # A changed result can end or extend a streak anywhere in its run, so streaks are recounted from history
+        _set_player_stats({user_id: {"streak": streak} for user_id, streak in
+                           _calculate_streaks(changed_user_ids).items()})
+
+
+def _calculate_streaks(user_ids=None) -> Dict[int, int]:
+    query = {} if user_ids is None else {"userId": {"$in": user_ids}}
+    streaks = {user_id: 0 for user_id in user_ids or []}
+    finished = set()
+    # PlayerData has no timestamp; ObjectIds increase with insertion order
+    for result in mongo.db["PlayerData"].find(query, {"userId": 1, "outcome": 1}).sort("_id", -1):
+        user_id = result["userId"]
+        if user_id in finished:
+            continue
+        outcome = Outcome(result["outcome"])
+        streak = streaks.get(user_id, 0)
+        if outcome == Outcome.WIN and streak >= 0:
+            streaks[user_id] = streak + 1
+        elif outcome == Outcome.LOSS and streak <= 0:
+            streaks[user_id] = streak - 1
+        else:
+            streaks[user_id] = streak
+            finished.add(user_id)
+    return streaks
+
+
+def _set_player_stats(stats_by_user_id: Dict[int, dict]):
+    if not stats_by_user_id:
+        return
+    mongo.db['Profiles'].bulk_write([UpdateOne({"userId": user_id}, {"$set": stats})
+                                     for user_id, stats in stats_by_user_id.items()])
+    for user_id, stats in stats_by_user_id.items():
+        cached = _profiles.get(user_id)
+        if cached is not None:
+            cached.update(stats)
+        else:
+            profile_loader.forget(user_id)
+
+
+def rebuild_player_stats() -> int:
+    """
+    Recounts every profile's results and streak from PlayerData
+    :return: Number of profiles whose counters were wrong
+    """
+    expected = {}
+    for totals in mongo.db["PlayerData"].aggregate([{"$group": {
+        "_id": "$userId",
+        **{field: {"$sum": {"$cond": [{"$eq": ["$outcome", outcome.value]}, 1, 0]}}
+           for outcome, field in STAT_FIELDS.items()}
+    }}]):
+        expected[totals["_id"]] = {field: totals[field] for field in STAT_FIELDS.values()}
+    for user_id, streak in _calculate_streaks().items():
+        expected[user_id]["streak"] = streak
+
+    fields = [*STAT_FIELDS.values(), "streak"]
+    corrections = {}
+    for profile in mongo.db['Profiles'].find({}, {"userId": 1, **{field: 1 for field in fields}}):
+        stats = expected.get(profile["userId"], {field: 0 for field in fields})
+        if any(profile.get(field) != value for field, value in stats.items()):
+            corrections[profile["userId"]] = stats
+    _set_player_stats(corrections)
+    return len(corrections)
+
+
+def player_stats_exist() -> bool:
+    return mongo.db['Profiles'].find_one({"wins": {"$exists": True}}) is not None
+
 
 def get_player_stats(user_id) -> Tuple[int, int, int]:
     """
     :param user_id:
     :return: Tuple of wins, losses, and ties
     """
-    wins = mongo.db["PlayerData"].count_documents({"userId": user_id, "outcome": Outcome.WIN.value})
-    losses = mongo.db["PlayerData"].count_documents({"userId": user_id, "outcome": Outcome.LOSS.value})
-    ties = mongo.db["PlayerData"].count_documents({"userId": user_id, "outcome": Outcome.TIE.value})
-    return wins, losses, ties
+    profile = get_profile_by_id(user_id) or {}
+    return profile.get("wins", 0), profile.get("losses", 0), profile.get("ties", 0)
+
+
+def get_player_streak(user_id) -> int:
+    """
+    :return: Current streak, positive for wins and negative for losses
+    """
+    return (get_profile_by_id(user_id) or {}).get("streak", 0)
 
 
 def query_player_game_results(game_ids: List[str]) -> List[PlayerGameResult]:
@@ -200,42 +459,24 @@ def remove_single_warnings(user, userwarnings, amount):
 
 
 def get_all_banned():
-    return mongo.db['Banned'].find({})
+    return list(mongo.db['Banned'].find({}))
 
 
 def get_all_warned():
-    return mongo.db['Warnings'].find({})
+    return list(mongo.db['Warnings'].find({}))
 
 
 def update_member_region(user, region):
-    data = {
-        "$set": {
-            "region": region
-        }
-    }
-
-    mongo.db['Profiles'].update_one({"userId": user.id}, data)
+    _update_profile(user.id, {"region": region})
 
 
 def update_player_position_new(user, position):
-    data = {
-        "$set": {
-            "position": position
-        }
-    }
-
-    mongo.db['Profiles'].update_one({"userId": user.id}, data)
+    _update_profile(user.id, {"position": position})
 
 
 def update_stats_visibility(user, visible):
-    data = {
-        "$set": {
-            "hideRank": True if visible == "Hide" else False
-        }
-    }
-
-    mongo.db['Profiles'].update_one({"userId": user.id}, data)
+    _update_profile(user.id, {"hideRank": True if visible == "Hide" else False})
 
 
 def query_profiles(user_ids):
-    return mongo.db['Profiles'].find({"userId": {"$in": user_ids}})
+    return list(get_profiles_by_ids(user_ids).values())
@@ -36,7 +36,7 @@ def get_queue_count(queue: Queue):
 
 
 def get_queue_players(queue):
-    return mongo.db['Queue'].find({"queue": queue})
+    return list(mongo.db['Queue'].find({"queue": queue}))
 
 
 def check_if_in_queue(user, queue: Queue):
@@ -70,11 +70,11 @@ def queue_is_ingame(queue):
 
 
 def get_ingame_queue_game_data(queue):
-    return mongo.db['GameData'].find({"queue": queue, "status": 2})
+    return list(mongo.db['GameData'].find({"queue": queue, "status": 2}))
 
 
 def get_all_queue_players():
-    return mongo.db['Queue'].find({})
+    return list(mongo.db['Queue'].find({}))
 
 
 def auto_remove_from_queue(user_id):
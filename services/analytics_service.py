@@ -1,84 +1,166 @@
+import asyncio
 import calendar
 import datetime
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 
-from models.game import EmptyGame
-from models.leaderboards import Leaderboard, PlayerStatsInLeaderboard
-from models.profile import PlayerGameResult, Outcome
-from schemas import member_schema
-from services import game_service
+from includes import metrics
+from models.leaderboards import Leaderboard, PlayerStatsInLeaderboard, MapStats
+from schemas import analytics_schema, member_schema
+from services import map_service
 
 NUM_TOP_RESULTS = 10
+NUM_POPULAR_MAPS = 3
+# Maps need this many decided games before their side balance is used to suggest a weight
+MIN_GAMES_FOR_WEIGHT = 10
+MAX_MAP_WEIGHT = 5
 
+# Set while no full rebuild is running. A rebuild recounts from a snapshot taken when it starts and replaces every
+# rollup, so results recorded or reports cached while it runs would be overwritten or read from half-filled buckets;
+# result writes and report reads wait for it instead. Created on first rebuild so it binds to the running loop.
+_rebuild_done: Optional[asyncio.Event] = None
 
-def get_leaderboard(year: int = None, month: int = None) -> Leaderboard:
-    # Neither - default to all time
-    if year is None and month is None:
-        start_date = None
-        end_date = None
-    else:
-        # No year - default to current
-        if year is None and month is not None:
-            year = datetime.datetime.now().year
-
-        # No month - default to whole year
-        if month is None and year is not None:
-            start_date = datetime.date(year, 1, 1)
-            end_date = datetime.date(year, 12, 31)
-        else:
-            start_date = datetime.date(year, month, 1)
-            end_date = datetime.date(year, month, calendar.monthrange(year, month)[1])
-
-    games: List[EmptyGame] = game_service.query_empty(start_date, end_date)
-    player_stats = calculate_player_stats(member_schema.query_player_game_results([game.game_id for game in games]))
-    return Leaderboard(start_date, end_date, len(games), calculate_popular_maps(games),
-                       find_players_with_most_games(player_stats), find_players_with_most_wins(player_stats),
-                       find_players_with_highest_winrates(player_stats), len(player_stats))
-
-
-def calculate_popular_maps(games: List[EmptyGame]) -> List[Tuple[str, int]]:
-    map_frequencies = {}
-    for game in games:
-        for m in game.maps:
-            map_frequencies[m] = map_frequencies.get(m, 0) + 1
 
-    sorted_desc = sorted(map_frequencies.items(), key=lambda pair: pair[1], reverse=True)
-    return [(pair[0], pair[1]) for pair in sorted_desc[:3]]
+def rebuilding() -> bool:
+    return _rebuild_done is not None and not _rebuild_done.is_set()
 
 
-def calculate_player_stats(player_game_results: List[PlayerGameResult]) -> List[PlayerStatsInLeaderboard]:
-    by_user_id = {}
-    for result in player_game_results:
-        if result.user_id not in by_user_id:
-            profile_raw = member_schema.get_profile_by_id(result.user_id)
-            by_user_id[result.user_id] = PlayerStatsInLeaderboard(result.user_id, profile_raw["username"], 0, 0, 0, 0)
+async def wait_for_rebuild():
+    while rebuilding():
+        await _rebuild_done.wait()
 
-        existing = by_user_id[result.user_id]
-        if result.outcome == Outcome.WIN:
-            by_user_id[result.user_id] = existing.with_win()
-        elif result.outcome == Outcome.LOSS:
-            by_user_id[result.user_id] = existing.with_loss()
-        elif result.outcome == Outcome.TIE:
-            by_user_id[result.user_id] = existing.with_tie()
 
-    return list(by_user_id.values())
+async def rebuild(player_stats: bool = True, rollups: bool = True) -> int:
+    """
+    Recounts profile counters and/or rollups off the event loop, holding result writes and report reads until done
+    :return: Number of profiles whose counters were wrong
+    """
+    global _rebuild_done
+    await wait_for_rebuild()
+    _rebuild_done = asyncio.Event()
+    loop = asyncio.get_event_loop()
+    try:
+        corrected = await loop.run_in_executor(None, member_schema.rebuild_player_stats) if player_stats else 0
+        if rollups:
+            await loop.run_in_executor(None, analytics_schema.rebuild_rollups)
+    finally:
+        _rebuild_done.set()
+    return corrected
 
 
-def find_players_with_highest_winrates(player_stats: List[PlayerStatsInLeaderboard]) -> List[Tuple[str, float]]:
-    players_with_winrates = [player for player in player_stats if player.winrate is not None]
-    sorted_by_winrate_desc = sorted(players_with_winrates, key=lambda player: player.winrate, reverse=True)
-    sorted_players_with_min_num_games = [player for player in sorted_by_winrate_desc if player.total_games >= 5]
-    if len(sorted_players_with_min_num_games) >= NUM_TOP_RESULTS:
-        return [(player.username, player.winrate) for player in sorted_players_with_min_num_games][:NUM_TOP_RESULTS]
-
-    return [(player.username, player.winrate) for player in sorted_by_winrate_desc][:NUM_TOP_RESULTS]
-
-
-def find_players_with_most_games(player_stats: List[PlayerStatsInLeaderboard]) -> List[Tuple[str, int]]:
-    sorted_by_games_desc = sorted(player_stats, key=lambda player: player.total_games, reverse=True)[:NUM_TOP_RESULTS]
-    return [(player.username, player.total_games) for player in sorted_by_games_desc]
+def _period_dates(year: Optional[int], month: Optional[int]) -> Tuple[Optional[datetime.date], Optional[datetime.date]]:
+    # Neither - default to all time
+    if year is None and month is None:
+        return None, None
+    # No month - default to whole year
+    if month is None:
+        return datetime.date(year, 1, 1), datetime.date(year, 12, 31)
+    return datetime.date(year, month, 1), datetime.date(year, month, calendar.monthrange(year, month)[1])
 
 
-def find_players_with_most_wins(player_stats: List[PlayerStatsInLeaderboard]) -> List[Tuple[str, int]]:
-    sorted_by_wins_desc = sorted(player_stats, key=lambda player: player.wins, reverse=True)[:NUM_TOP_RESULTS]
-    return [(player.username, player.wins) for player in sorted_by_wins_desc]
+def get_leaderboard(year: int = None, month: int = None) -> Leaderboard:
+    # No year - default to current
+    if year is None and month is not None:
+        year = datetime.datetime.now().year
+    start_date, end_date = _period_dates(year, month)
+
+    key = analytics_schema.leaderboard_cache_key(year, month)
+    cached = analytics_schema.get_cached_leaderboard(key)
+    if cached is not None:
+        metrics.inc("cache_hits_total", cache="leaderboard")
+        return _leaderboard_from_document(cached)
+
+    metrics.inc("cache_misses_total", cache="leaderboard")
+    leaderboard = get_leaderboard_between(start_date, end_date)
+    analytics_schema.save_cached_leaderboard(key, _leaderboard_to_document(leaderboard))
+    return leaderboard
+
+
+def get_leaderboard_for_last_days(days: int) -> Leaderboard:
+    today = datetime.date.today()
+    return get_leaderboard_between(today - datetime.timedelta(days=days - 1), today)
+
+
+def get_leaderboard_between(start_date: Optional[datetime.date], end_date: Optional[datetime.date]) -> Leaderboard:
+    """
+    :param start_date: First day included, None with end_date for all time
+    :param end_date: Last day included
+    """
+    players = analytics_schema.query_player_leaderboard(start_date, end_date, NUM_TOP_RESULTS)
+    summary = analytics_schema.query_game_summary(start_date, end_date, NUM_POPULAR_MAPS)
+
+    # Prefer players with enough games for their winrate to mean something, unless there aren't enough of them
+    highest_winrate = players["highestWinrate"] if len(players["highestWinrate"]) >= NUM_TOP_RESULTS \
+        else players["anyWinrate"]
+
+    return Leaderboard(start_date, end_date, summary["games"],
+                       [(row["_id"], row["count"]) for row in summary["maps"]],
+                       [(stats.username, stats.total_games) for stats in _to_player_stats(players["mostGames"])],
+                       [(stats.username, stats.wins) for stats in _to_player_stats(players["mostWins"])],
+                       [(stats.username, stats.winrate) for stats in _to_player_stats(highest_winrate)],
+                       players["players"])
+
+
+def _to_player_stats(rows: List[dict]) -> List[PlayerStatsInLeaderboard]:
+    return [PlayerStatsInLeaderboard(row["_id"], row.get("username"), row["games"], row["wins"], row["losses"],
+                                     row["ties"]) for row in rows]
+
+
+def _leaderboard_to_document(leaderboard: Leaderboard) -> dict:
+    # BSON has no date type, so period bounds are stored as midnight datetimes
+    return {
+        "start": None if leaderboard.start_date is None else datetime.datetime.combine(leaderboard.start_date,
+                                                                                       datetime.time()),
+        "end": None if leaderboard.end_date is None else datetime.datetime.combine(leaderboard.end_date,
+                                                                                   datetime.time()),
+        "totalGames": leaderboard.total_games,
+        "mostPopularMaps": leaderboard.most_popular_maps,
+        "mostGamesPlayed": leaderboard.most_games_played,
+        "mostGamesWon": leaderboard.most_games_won,
+        "highestWinrate": leaderboard.highest_winrate,
+        "uniquePlayers": leaderboard.unique_players,
+    }
+
+
+def _leaderboard_from_document(document: dict) -> Leaderboard:
+    def pairs(key):
+        return [tuple(pair) for pair in document[key]]
+
+    return Leaderboard(document["start"] and document["start"].date(), document["end"] and document["end"].date(),
+                       document["totalGames"], pairs("mostPopularMaps"), pairs("mostGamesPlayed"),
+                       pairs("mostGamesWon"), pairs("highestWinrate"), document["uniquePlayers"])
+
+
+def get_map_stats(year: int = None, month: int = None) -> List[MapStats]:
+    if year is None and month is not None:
+        year = datetime.datetime.now().year
+
+    key = analytics_schema.leaderboard_cache_key(year, month, report="maps")
+    cached = analytics_schema.get_cached_leaderboard(key)
+    if cached is not None:
+        metrics.inc("cache_hits_total", cache="map_stats")
+        rows = cached["maps"]
+    else:
+        metrics.inc("cache_misses_total", cache="map_stats")
+        rows = analytics_schema.query_map_stats(*_period_dates(year, month))
+        analytics_schema.save_cached_leaderboard(key, {"maps": rows})
+
+    return [MapStats(row["_id"], row["count"], row["team1Wins"], row["team2Wins"], row["ties"], row["timed"],
+                     row["durationSeconds"]) for row in rows]
+
+
+def suggest_map_weights(map_stats: List[MapStats]) -> Dict[str, float]:
+    """
+    Suggests maps.csv weights from side balance: an even map gets MAX_MAP_WEIGHT, a map one side always wins gets 0.
+    Maps without enough decided games keep their current weight.
+    :return: Map name -> weight for every map in the pool
+    """
+    stats_by_name = {stats.name: stats for stats in map_stats}
+    weights = {}
+    for name, weight in map_service.maps.items():
+        stats = stats_by_name.get(name)
+        if stats is None or stats.decided_games < MIN_GAMES_FOR_WEIGHT:
+            weights[name] = weight
+        else:
+            balance = 1 - 2 * abs(stats.team1_winrate - 0.5)
+            weights[name] = round(MAX_MAP_WEIGHT * balance, 1)
+    return weights
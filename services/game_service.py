@@ -5,13 +5,15 @@ from typing import List, Tuple, Dict
 
 from discord import User, Member
 
+import config
 from includes.general import convert_keys_to_str
+from includes.loader import request_scope
 from models.game import Game, GameStatus, EmptyGame, FinishedGame
 from models.ingame_models import SwapResult, SwapError, ScrambleError
 from models.profile import Outcome
 from models.queue_models import Queue, UserInGame
-from schemas import ingame_schema, member_schema, queue_schema
-from services import map_service
+from schemas import ingame_schema, member_schema, queue_schema, analytics_schema
+from services import map_service, ladder_service
 
 
 def swap(user: User, target: User) -> SwapResult:
@@ -31,7 +33,10 @@ def swap(user: User, target: User) -> SwapResult:
 
 
 def get_games(queue: Queue = None) -> List[Game]:
-    return [game_data_to_game_model(game_data) for game_data in ingame_schema.get_games(queue)]
+    with request_scope():
+        games = ingame_schema.get_games(queue)
+        ingame_schema.roster_loader.prefetch([game_data['gameId'] for game_data in games])
+        return [game_data_to_game_model(game_data) for game_data in games]
 
 
 def game_data_to_game_model(game_data) -> Game:
@@ -43,7 +48,7 @@ def game_data_to_game_model(game_data) -> Game:
     team1 = []
     team2 = []
 
-    for player in ingame_schema.get_all_ingame_players(game_id):
+    for player in ingame_schema.roster_loader.load(game_id) or []:
         if player["team"] is None:
             unassigned.append(UserInGame(player["userId"], player["username"], False))
         elif player["team"] == 1:
@@ -64,8 +69,9 @@ def sort_players_by_name(players: List[UserInGame]):
 def start_game(user: User, queue: Queue) -> Game:
     queue_schema.remove_from_other_queues(user, queue)
     game_id = generate_game_id()
-    maps = map_service.get_maps(num_maps=1)
+    maps = map_service.get_maps(num_maps=1, queue=queue, cooldown=True)
     ingame_schema.create_game(queue, game_id, maps)
+    map_service.record_played(game_id, maps)
     ingame_schema.generate_teams(queue, game_id)
 
     game_data = ingame_schema.get_game(game_id)
@@ -87,10 +93,11 @@ def get(game_id) -> Game:
 
 
 def get_empty(game_id) -> EmptyGame:
-    game_data = ingame_schema.get_game(game_id)
-    game_queue = Queue(game_data['queue'])
+    return game_data_to_empty_game(ingame_schema.get_game(game_id))
+
 
-    return EmptyGame(game_id, game_data['started'], game_queue, game_data.get("ended"),
+def game_data_to_empty_game(game_data) -> EmptyGame:
+    return EmptyGame(game_data['gameId'], game_data['started'], Queue(game_data['queue']), game_data.get("ended"),
                      GameStatus(game_data["status"]), game_data.get("maps"))
 
 
@@ -109,14 +116,16 @@ def scramble_map(user, map_number) -> Tuple[List[str], ScrambleError]:
         return None, ScrambleError.USER_NOT_IN_GAME
 
     game_id = ingame_schema.get_game_id_from_user(user)
-    maps = get(game_id).maps
+    game = get(game_id)
+    maps = game.maps
     if map_number > len(maps):
         return maps, ScrambleError.INVALID_MAP_NUMBER
 
-    new_map = map_service.get_maps(1, set(maps))[0]
+    new_map = map_service.get_maps(1, set(maps), queue=game.queue)[0]
 
     maps[map_number - 1] = new_map
     ingame_schema.update_maps(game_id, maps)
+    map_service.record_played(game_id, maps)
     return maps, None
 
 
@@ -173,13 +182,17 @@ def finish(user, outcome: Outcome) -> EmptyGame:
         loser_ids = [player.user_id for player in players_on_other_team]
         user_ids_to_outcome = {user_id: Outcome.TIE for user_id in winner_ids + loser_ids}
 
-    ingame_schema.finish_game(game_id)
+    user_team = 1 if game.is_on_team1(user.id) else 2
+    winning_team = {Outcome.WIN: user_team, Outcome.LOSS: 3 - user_team, Outcome.TIE: 0}[outcome]
+    ingame_schema.finish_game(game_id, winning_team)
     member_schema.finish_game_for_users(game_id, user_ids_to_outcome)
     delay_targets = calculate_delay_targets(list(user_ids_to_outcome.keys()))
     member_schema.set_delay_targets(delay_targets)
-    ingame_schema.update_rankings(winner_ids, loser_ids, outcome == Outcome.TIE)
+    ladder_service.update(ingame_schema.update_rankings(winner_ids, loser_ids, outcome == Outcome.TIE))
 
-    return get_empty(game_id)
+    game_data = ingame_schema.get_game(game_id)
+    analytics_schema.record_game(game_data, user_ids_to_outcome)
+    return game_data_to_empty_game(game_data)
 
 
 def cancel_game(user: User) -> bool:
@@ -193,14 +206,18 @@ def cancel_game(user: User) -> bool:
 
 
 def is_captain(user):
-    game_id = ingame_schema.get_game_id_from_user(user)
-    game = get(game_id)
-    return user.id in (game.team1_captain.user_id, game.team2_captain.user_id)
+    return ingame_schema.is_captain(user)
 
 
 def get_history() -> List[FinishedGame]:
+    with request_scope():
+        return _get_history()
+
+
+def _get_history() -> List[FinishedGame]:
     games = ingame_schema.get_recent_games(5)
     player_game_results = member_schema.query_player_game_results([game.game_id for game in games])
+    member_schema.profile_loader.prefetch([result.user_id for result in player_game_results])
     finished_games = []
 
     for game in games:
@@ -233,35 +250,33 @@ def flip_results(game_id: str) -> bool:
 
     member_schema.update_outcome_for_users(game_id, winner_ids, Outcome.LOSS)
     member_schema.update_outcome_for_users(game_id, loser_ids, Outcome.WIN)
-    ingame_schema.update_rankings(loser_ids, winner_ids, False)
+    ladder_service.update(ingame_schema.update_rankings(loser_ids, winner_ids, False))
+    analytics_schema.record_flip(ingame_schema.flip_winning_team(game_id), winner_ids, loser_ids)
 
     return True
 
 
 def pick_suggested_server(players):
-    regions = []
-
-    for player in players:
-        player_region = member_schema.get_player_region(player.user_id)
-        if player_region != "Not Set":
-            regions.append(player_region)
-
-    na_servers = ["Chicago PUG", "Los Angeles PUG"]
-    eu_servers = ["London PUG"]
-    aus_servers = ["Sydney Optimised PUG"]
-
-    if not regions:
-        return random.choice(aus_servers)
-
-    def popular(lst):
-        return max(set(lst), key=lst.count)
-
-    most_popular = popular(regions)
-
-    if most_popular == "EU":
-        return random.choice(eu_servers)
-    elif most_popular == "NA":
-        return random.choice(na_servers)
+    """
+    Picks the server that minimises the roster's worst-case or average expected ping, per config.server_pings.
+    Players without a known region don't count; ties are broken at random.
+    """
+    # Only regions every server has a ping for; "Not Set" and anything unlisted doesn't count
+    known_regions = set.intersection(*[set(pings) for pings in config.server_pings.values()])
+    profiles = member_schema.profile_loader.load_many([player.user_id for player in players])
+    regions = [profile['region'] for profile in profiles.values() if profile.get('region') in known_regions]
+
+    def cost(server):
+        pings = [config.server_pings[server][region] for region in regions]
+        if not pings:
+            return 0
+        if config.variables['server_objective'] == "mean":
+            return sum(pings) / len(pings)
+        return max(pings)
+
+    costs = {server: cost(server) for server in config.server_pings}
+    best = min(costs.values())
+    return random.choice([server for server, server_cost in costs.items() if server_cost == best])
 
 
 def update_game_server(game_id, server):
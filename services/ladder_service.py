@@ -0,0 +1,97 @@
+import bisect
+import math
+from typing import Dict, List, Optional, Tuple
+
+from trueskill import Rating
+
+from models.ladder import LadderEntry
+from schemas import member_schema
+
+PAGE_SIZE = 15
+NEIGHBOURHOOD_RADIUS = 2
+
+# Players ordered by conservative skill (mu - 3 sigma), best first. Entries are (-score, userId) so the list sorts
+# ascending and ties break on user id; _scores maps each user to the score their entry was inserted with.
+_ladder: List[Tuple[float, int]] = []
+_scores: Dict[int, float] = {}
+
+
+def conservative_score(mu: float, sigma: float) -> float:
+    return mu - 3 * sigma
+
+
+def load():
+    """
+    Rebuilds the ladder from one scan of the rated players in Ranks
+    """
+    global _ladder
+    _scores.clear()
+    for rank in member_schema.get_rated_ranks():
+        _scores[rank['userId']] = conservative_score(rank['rank'], rank['confidence'])
+    _ladder = sorted((-score, user_id) for user_id, score in _scores.items())
+
+
+def update(ratings: Dict[int, Rating]):
+    """
+    Moves each rated player to their new place. Finding the place is O(log n); the delete and insert shift the list
+    tail, so each move is O(n) memmove, which at this ladder's size (one entry per player who has played) stays
+    well under the cost of the rating update itself.
+    """
+    for user_id, rating in ratings.items():
+        if user_id in _scores:
+            del _ladder[bisect.bisect_left(_ladder, (-_scores[user_id], user_id))]
+        score = conservative_score(rating.mu, rating.sigma)
+        _scores[user_id] = score
+        bisect.insort(_ladder, (-score, user_id))
+
+
+def size() -> int:
+    return len(_ladder)
+
+
+def position(user_id) -> Optional[int]:
+    """
+    :return: 1-indexed ladder position, None if the player is unrated
+    """
+    if user_id not in _scores:
+        return None
+    return bisect.bisect_left(_ladder, (-_scores[user_id], user_id)) + 1
+
+
+def percentile(user_id) -> Optional[float]:
+    """
+    :return: Percentage of rated players ranked below the player
+    """
+    player_position = position(user_id)
+    if player_position is None:
+        return None
+    return 100 * (size() - player_position) / size()
+
+
+def neighbourhood(user_id, radius: int = NEIGHBOURHOOD_RADIUS) -> List[LadderEntry]:
+    player_position = position(user_id)
+    if player_position is None:
+        return []
+    return _entries(max(0, player_position - 1 - radius), player_position + radius)
+
+
+def page_count(page_size: int = PAGE_SIZE) -> int:
+    return max(1, math.ceil(size() / page_size))
+
+
+def page_of(user_id, page_size: int = PAGE_SIZE) -> Optional[int]:
+    player_position = position(user_id)
+    return None if player_position is None else (player_position - 1) // page_size + 1
+
+
+def get_page(page: int, page_size: int = PAGE_SIZE) -> List[LadderEntry]:
+    """
+    :param page: 1-indexed
+    """
+    start = (page - 1) * page_size
+    return _entries(start, start + page_size)
+
+
+def _entries(start: int, end: int) -> List[LadderEntry]:
+    return [LadderEntry(user_id, index + 1, -negative_score)
+            for index, (negative_score, user_id) in enumerate(_ladder[start:end], start)]
@@ -1,41 +1,172 @@
 import os
 import random
-from typing import List, Set
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
 
-maps = {}
-path = os.path.join(os.path.dirname(__file__), "maps.csv")
-with open(path, "r") as maps_file:
-    # Ignore header
-    lines = maps_file.readlines()[1:]
+import config
+from models.queue_models import Queue
+from schemas import ingame_schema
 
-    for line in lines:
-        name, weight = line.strip().split(",")
-        maps[name] = float(weight)
+MAPS_DIRECTORY = os.path.dirname(__file__)
+DEFAULT_MAPS_FILE = "maps.csv"
+# Below this share of the pool's weight left after exclusions, rejection sampling gives way to a direct draw
+MIN_REJECTION_WEIGHT_SHARE = 0.25
 
 
-def get_maps(num_maps=2, exclude=None) -> List[str]:
-    if exclude is None:
-        exclude = set()
-    if num_maps + len(exclude) > len(maps):
-        raise ValueError("Asking for and excluding too many maps")
+class MapPool:
+    """
+    Weighted map sampler backed by an alias table, so each draw is O(1) however many maps are in the pool.
+    Excluded maps are handled by redrawing, which stays cheap while the excluded maps hold little of the weight.
+    """
 
-    results = []
-    new_exclude = exclude.copy()
-    for i in range(num_maps):
-        single_map = get_map_weighted(new_exclude)
-        results.append(single_map)
-        new_exclude = new_exclude.union({single_map})
+    def __init__(self, weights: Dict[str, float]):
+        self.weights = dict(weights)
+        self.names = list(weights)
+        self.total_weight = sum(weights.values())
+        self._probabilities, self._aliases = _build_alias_table([weights[name] for name in self.names])
 
-    return results
+    def sample(self, exclude: Set[str] = frozenset()) -> str:
+        remaining_weight = self.total_weight - sum(self.weights.get(name, 0) for name in exclude)
+        if remaining_weight <= 0:
+            raise ValueError("No weighted maps left to pick from")
+
+        if remaining_weight >= MIN_REJECTION_WEIGHT_SHARE * self.total_weight:
+            while True:
+                name = self._draw()
+                if name not in exclude:
+                    return name
+
+        pool = [name for name in self.names if name not in exclude]
+        return random.choices(pool, weights=[self.weights[name] for name in pool])[0]
+
+    def sample_many(self, num_maps: int, exclude: Set[str] = frozenset()) -> List[str]:
+        if num_maps + len(exclude & self.weights.keys()) > len(self.names):
+            raise ValueError("Asking for and excluding too many maps")
+
+        results = []
+        excluded = set(exclude)
+        for _ in range(num_maps):
+            name = self.sample(excluded)
+            results.append(name)
+            excluded.add(name)
+        return results
+
+    def _draw(self) -> str:
+        column = random.randrange(len(self.names))
+        return self.names[column] if random.random() < self._probabilities[column] else self.names[self._aliases[column]]
+
+
+def _build_alias_table(weights: List[float]):
+    """
+    Vose's alias method: every column holds its own outcome with some probability and one alias for the rest
+    """
+    count = len(weights)
+    total = sum(weights)
+    probabilities = [0.0] * count
+    aliases = list(range(count))
+    if total <= 0:
+        return probabilities, aliases
+
+    scaled = [weight * count / total for weight in weights]
+    small = [index for index, value in enumerate(scaled) if value < 1]
+    large = [index for index, value in enumerate(scaled) if value >= 1]
+    while small and large:
+        less, more = small.pop(), large.pop()
+        probabilities[less] = scaled[less]
+        aliases[less] = more
+        scaled[more] -= 1 - scaled[less]
+        (small if scaled[more] < 1 else large).append(more)
+    for index in small + large:
+        probabilities[index] = 1.0
+    return probabilities, aliases
+
+
+def _read_maps_file(path) -> Dict[str, float]:
+    weights = {}
+    with open(path, "r") as maps_file:
+        # Ignore header
+        lines = maps_file.readlines()[1:]
+
+        for line in lines:
+            if not line.strip():
+                continue
+            name, weight = line.strip().split(",")
+            weights[name] = float(weight)
+    return weights
+
+
+# Map name -> weight for the default pool
+maps: Dict[str, float] = {}
+# A queue uses services/maps_<queue>.csv when it exists, otherwise the default pool
+_default_pool: Optional[MapPool] = None
+_queue_pools: Dict[Queue, MapPool] = {}
+# Bumped on every reload so anything built from the map list knows to rebuild
+version = 0
+# Game id -> maps of the most recent games, newest last
+COOLDOWN_GAMES = config.variables['map_cooldown_games']
+_recent_maps: "OrderedDict[str, List[str]]" = OrderedDict()
+
+
+def reload() -> int:
+    """
+    Re-reads the map files without a restart
+    :return: The new version
+    """
+    global maps, _default_pool, _queue_pools, version
+    default_weights = _read_maps_file(os.path.join(MAPS_DIRECTORY, DEFAULT_MAPS_FILE))
+    queue_pools = {}
+    for queue in Queue:
+        path = os.path.join(MAPS_DIRECTORY, f"maps_{queue.value}.csv")
+        if os.path.exists(path):
+            queue_pools[queue] = MapPool(_read_maps_file(path))
+
+    maps, _default_pool, _queue_pools = default_weights, MapPool(default_weights), queue_pools
+    version += 1
+    return version
+
+
+def load_recent_maps():
+    _recent_maps.clear()
+    # limit(0) would mean no limit
+    if COOLDOWN_GAMES <= 0:
+        return
+    for game in reversed(ingame_schema.get_recently_started_games(COOLDOWN_GAMES)):
+        record_played(game['gameId'], game.get('maps') or [])
+
+
+def record_played(game_id, game_maps: List[str]):
+    """
+    Notes the maps a game is being played on. Calling it again for the same game replaces its maps.
+    """
+    _recent_maps[game_id] = list(game_maps)
+    while len(_recent_maps) > COOLDOWN_GAMES:
+        _recent_maps.popitem(last=False)
+
+
+def get_pool(queue: Queue = None) -> MapPool:
+    return _queue_pools.get(queue, _default_pool)
+
+
+def get_maps(num_maps=2, exclude=None, queue: Queue = None, cooldown=False) -> List[str]:
+    """
+    :param cooldown: Also avoid maps from the last few games, as long as enough maps are left
+    """
+    pool = get_pool(queue)
+    exclude = set() if exclude is None else set(exclude)
+    if cooldown:
+        cooling = exclude.union(*_recent_maps.values())
+        remaining = [name for name in pool.names if name not in cooling and pool.weights[name] > 0]
+        if len(remaining) >= num_maps:
+            exclude = cooling
+    return pool.sample_many(num_maps, exclude)
 
 
 def get_map_weighted(exclude=None) -> str:
-    if exclude is None:
-        exclude = []
-    map_pool = list(maps.keys() - exclude)
-    weights = [maps[m] for m in map_pool]
-    return random.choices(map_pool, weights=weights)[0]
+    return get_pool().sample(set() if exclude is None else set(exclude))
 
 
 def get_all_map_names_alphabetical():
     return sorted(list(maps.keys()))
+
+
+reload()
@@ -1,11 +1,38 @@
+import time
+from typing import Optional
+
+from discord import User
+
+import config
+from includes.cache import TTLCache
 from models.profile import Profile
 from schemas import member_schema
 
+SETUP_EXPIRY_SECONDS = config.variables['expire_message'] * 60
+
+# User id -> expiry timestamp of the setup wizard open in their DMs
+_active_setups = TTLCache("setup_wizard", maxsize=1000, ttl=SETUP_EXPIRY_SECONDS)
+
 
 def get(user_id) -> Profile:
     profile_data = member_schema.get_profile_by_id(user_id)
     rank = member_schema.get_player_rank_by_id(user_id)
-    wins, losses, ties = member_schema.get_player_stats(user_id)
     return Profile(user_id, profile_data["username"], profile_data["position"], profile_data["lastPlayed"],
                    profile_data["hideRank"], profile_data["gamesPlayed"], profile_data.get("bio"), rank["rank"],
-                   rank["confidence"], wins, losses, ties)
+                   rank["confidence"], profile_data.get("wins", 0), profile_data.get("losses", 0),
+                   profile_data.get("ties", 0), profile_data.get("streak", 0))
+
+
+def start_setup(user: User) -> Optional[int]:
+    """
+    :return: Expiry timestamp for the new setup wizard, or None if the user already has one open
+    """
+    if user.id in _active_setups:
+        return None
+    expires = int(time.time()) + SETUP_EXPIRY_SECONDS
+    _active_setups.set(user.id, expires)
+    return expires
+
+
+def finish_setup(user: User):
+    _active_setups.pop(user.id)
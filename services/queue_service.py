@@ -1,9 +1,11 @@
 from datetime import datetime
+from typing import List
 
 from discord import User
 
-from models.queue_models import Queue, AddResult, AddStatus
+from models.queue_models import Queue, AddResult, AddStatus, QueueStatus
 from schemas import member_schema, queue_schema, ingame_schema
+from services import game_service
 
 
 def add(user: User, queue: Queue, skip_delay=True) -> AddResult:
@@ -28,11 +30,12 @@ def add(user: User, queue: Queue, skip_delay=True) -> AddResult:
 
 
 def valid_for_re_add(user: User):
-    most_recent_games = ingame_schema.get_recent_games(1)
-    if len(most_recent_games) == 0:
-        return False
+    return ingame_schema.was_in_last_finished_game(user.id)
 
-    game = most_recent_games[0]
-    user_ids = member_schema.query_user_ids_who_have_played_in_games([game.game_id])
 
-    return user.id in user_ids
+def get_status() -> List[QueueStatus]:
+    statuses = []
+    for queue in Queue:
+        usernames = [player['username'] for player in queue_schema.get_queue_players(queue.value)]
+        statuses.append(QueueStatus(queue, usernames, game_service.get_games(queue)))
+    return statuses
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+
+import config
+from includes import logger, metrics
+from includes.cache import TTLCache
+from models import twitch
+
+POLL_SECONDS = config.variables['twitch_poll_seconds']
+MAX_BACKOFF_SECONDS = 15 * 60
+# /streams lists this many of the most watched
+SHOWN_STREAMS = 5
+# A stream that disappears from the results for less than this (a missed page, a brief drop) isn't announced again
+ANNOUNCED_STREAM_SECONDS = 30 * 60
+
+twitch_streams = twitch.TwitchStreams(config.variables['twitch_client_id'], config.variables['twitch_client_secret'],
+                                      config.variables['twitch_game_id'],
+                                      auth_url=config.variables['twitch_auth_url'],
+                                      api_url=config.variables['twitch_api_url'],
+                                      streams_ttl=config.variables['twitch_streams_ttl'])
+
+# Streams from the last successful poll, None until the first one. /streams reads this instead of calling Helix.
+_snapshot: Optional[List[Dict]] = None
+_snapshot_at: Optional[float] = None
+# Ids of the broadcasts already announced or live at startup. Twitch gives each broadcast a new id, so a stream
+# that ends and starts again is announced again; entries expire once a broadcast hasn't been seen for a while.
+_announced = TTLCache("announced_streams", maxsize=1000, ttl=ANNOUNCED_STREAM_SECONDS)
+# Consecutive failed polls; each one doubles the wait before the next attempt
+_failures = 0
+_next_poll = 0.0
+
+
+def enabled() -> bool:
+    return bool(config.variables['twitch_client_id'] and config.variables['twitch_client_secret']
+                and config.variables['twitch_game_id'])
+
+
+def get_top_streams(count: int = SHOWN_STREAMS) -> List[Dict]:
+    """
+    :return: The most watched streams from the last poll; Helix returns them by viewer count
+    """
+    return (_snapshot or [])[:count]
+
+
+def snapshot_age() -> Optional[float]:
+    return None if _snapshot_at is None else time.monotonic() - _snapshot_at
+
+
+async def poll() -> List[Dict]:
+    """
+    Refreshes the snapshot when a poll is due
+    :return: Streams not announced yet. The first poll only records what is already live.
+    """
+    global _snapshot, _snapshot_at, _failures, _next_poll
+    now = time.monotonic()
+    if now < _next_poll:
+        return []
+
+    try:
+        streams = (await twitch_streams.get_streams()).get('data', [])
+    except (aiohttp.ClientError, asyncio.TimeoutError, twitch.TwitchError) as e:
+        _failures += 1
+        delay = min(POLL_SECONDS * 2 ** _failures, MAX_BACKOFF_SECONDS)
+        _next_poll = now + delay
+        metrics.inc("twitch_poll_failed_total")
+        logger.log(f"Polling streams failed, retrying in {delay}s: {e}", logging.WARNING)
+        return []
+
+    _failures = 0
+    _next_poll = now + POLL_SECONDS
+    first_poll = _snapshot is None
+    _snapshot, _snapshot_at = streams, now
+    metrics.set_gauge("twitch_live_streams", len(streams))
+    went_live = [stream for stream in streams if stream['id'] not in _announced]
+    for stream in streams:
+        # Refreshes the expiry of broadcasts that are still live
+        _announced.set(stream['id'], True)
+    return [] if first_poll else went_live
+
+
+async def close():
+    await twitch_streams.close()